@@ -1,23 +1,32 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Query
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Query, Response
 from fastapi.responses import JSONResponse
 from starlette.responses import FileResponse
 from typing import List, Literal
+import asyncio
+import functools
 import os
 from pathlib import Path
 import nltk
 
+import Database
+import Executors
+import Jobs
+import MinHash
 import Moderation
+import NlpModels
 import ReadFile
+import Settings
 import mongoDB
+from CreateTags import TagGenerate, TAGGER_VERSION, split_paragraphs, paragraph_hash
 from mongoDB import TagStructure, SearchFunction
-from CreateTags import TagGenerate
+from ResultCache import result_cache, fingerprint
 
 
 nltk.download('punkt')
 nltk.download('stopwords')
 app = FastAPI()
 
-UPLOAD_DIRECTORY = "uploads"
+UPLOAD_DIRECTORY = Settings.UPLOAD_DIRECTORY
 if not os.path.exists(UPLOAD_DIRECTORY):
     os.makedirs(UPLOAD_DIRECTORY)
 
@@ -28,17 +37,360 @@ PROGRAM_TAGS = list(tag_structure.get_dict_by_name("program_tags_dict").keys())
 DOC_TYPE_TAGS = list(tag_structure.get_dict_by_name("doc_type_dict").keys())
 OTHER_TAGS = tag_structure.get_dict_by_name("other_tags")
 
-def save_file_to_server(file: UploadFile) -> str:
-    file_name = Path(file.filename).name
-    file_location = os.path.join(UPLOAD_DIRECTORY, file_name)
-    file.file.seek(0)
-    content = file.file.read()
-    with open(file_location, "wb") as buffer:
-        buffer.write(content)
-    print(f"[DEBUG] Файл сохранен: {file_location} ({len(content)} байт)")
+def upload_path(file_name: str) -> str:
+    return os.path.join(UPLOAD_DIRECTORY, Path(file_name).name)
+
+def save_file_to_server(file_name: str, spooled_path: str, replace_path: str = None) -> str:
+    file_location = upload_path(file_name)
+    if replace_path and os.path.exists(replace_path):
+        os.remove(replace_path)
+    os.replace(spooled_path, file_location)
+    print(f"[DEBUG] Файл сохранен: {file_location} ({os.path.getsize(file_location)} байт)")
     return file_location
 
 
+def collect_selected_tags(*tag_lists):
+    """
+    Объединяет выбранные пользователем теги из нескольких списков
+    :param tag_lists: списки тегов
+    :return: массив тегов без пустых значений
+    """
+    final_tags = []
+    for tags in tag_lists:
+        if tags:
+            final_tags.extend(tag.strip() for tag in tags if tag.strip())
+    return final_tags
+
+
+async def spool_upload(file: UploadFile):
+    """
+    Записывает загруженный файл во временный файл каталога загрузок блоками, считая SHA-256
+    :param file: загруженный файл
+    :return: путь к временному файлу и SHA-256 его содержимого
+    """
+    spooled_path, file_hash, size = await Executors.pools.run_io(
+        ReadFile.spool_to_disk, file.file, UPLOAD_DIRECTORY, Settings.UPLOAD_CHUNK_SIZE
+    )
+    return spooled_path, file_hash
+
+
+async def receive_upload_text(file: UploadFile, keep=True):
+    """
+    Записывает загруженный файл на диск блоками, считая SHA-256, и извлекает из него текст в пуле процессов.
+    Текст кэшируется по SHA-256 содержимого
+    :param file: загруженный файл
+    :param keep: сохранить ли файл в каталог загрузок
+    :return: очищенный текст, SHA-256 содержимого файла и путь к сохраненному файлу
+    """
+    spooled_path, file_hash = await spool_upload(file)
+    try:
+        content = await extract_upload_text(file.filename, spooled_path, file_hash)
+        file_path = None
+        if keep:
+            file_path = await Executors.pools.run_io(save_file_to_server, file.filename, spooled_path)
+    finally:
+        if os.path.exists(spooled_path):
+            os.remove(spooled_path)
+    return content, file_hash, file_path
+
+
+async def move_to_uploads(collection, file_name, spooled_path, content, file_hash):
+    """
+    Проверяет, что документ не дублирует сохраненные, и переносит временный файл в каталог загрузок.
+    Проверка выполняется до переноса, чтобы не затереть файл другого документа с тем же именем
+    :param collection: коллекция, в которую сохраняется документ
+    :param file_name: имя загруженного файла
+    :param spooled_path: путь к временному файлу
+    :param content: текст документа
+    :param file_hash: SHA-256 содержимого файла
+    :return: путь к сохраненному файлу
+    """
+    duplicate = await Executors.pools.run_io(
+        mongoDB.find_duplicate, collection, file_name, upload_path(file_name), content, file_hash
+    )
+    if duplicate:
+        raise HTTPException(status_code=400, detail="Документ уже существует в базе данных")
+    return await Executors.pools.run_io(save_file_to_server, file_name, spooled_path)
+
+
+async def receive_and_store(file: UploadFile, store, final_tags, use_auto_tags, user):
+    """
+    Принимает загруженный файл, извлекает из него текст и сохраняет документ
+    :param file: загруженный файл
+    :param store: функция сохранения документа
+    :param final_tags: теги, выбранные пользователем
+    :param use_auto_tags: добавлять ли автоматически сгенерированные теги
+    :param user: пользователь, загрузивший документ
+    :return: ответ для пользователя
+    """
+    spooled_path, file_hash = await spool_upload(file)
+    try:
+        content = await extract_upload_text(file.filename, spooled_path, file_hash)
+        return await store(file.filename, content, file_hash, spooled_path, final_tags, use_auto_tags, user)
+    finally:
+        if os.path.exists(spooled_path):
+            os.remove(spooled_path)
+
+
+def remove_job_file(params):
+    """
+    Удаляет временный файл задачи загрузки, если он не был перенесен в каталог загрузок
+    :param params: параметры задачи
+    """
+    if os.path.exists(params["spooled_path"]):
+        os.remove(params["spooled_path"])
+
+
+async def submit_upload_job(kind, file: UploadFile, final_tags, use_auto_tags, user):
+    """
+    Записывает файл во временный файл, который принадлежит только этой задаче, и ставит его обработку
+    в очередь фоновых задач. В каталог загрузок файл переносится при сохранении документа
+    :param kind: тип задачи: upload или upload_for_moderation
+    :param file: загруженный файл
+    :param final_tags: теги, выбранные пользователем
+    :param use_auto_tags: добавлять ли автоматически сгенерированные теги
+    :param user: пользователь, загрузивший документ
+    :return: ответ со статусом 202 и ID задачи
+    """
+    spooled_path, file_hash = await spool_upload(file)
+    job_id = await Executors.pools.run_io(Jobs.job_queue.submit, kind, {
+        "file_name": file.filename,
+        "spooled_path": spooled_path,
+        "file_hash": file_hash,
+        "tags": final_tags,
+        "use_auto_tags": use_auto_tags,
+        "user": user
+    })
+    return JSONResponse(status_code=202, content={
+        "status": "accepted",
+        "job_id": str(job_id),
+        "filename": file.filename
+    })
+
+
+async def run_upload_job(job_id, params, store, collection):
+    """
+    Обрабатывает загруженный файл в фоновой задаче. Документ сохраняется с ID задачи, поэтому если его
+    уже сохранила предыдущая попытка, повторная попытка завершается успешно, а не ошибкой о дубликате
+    :param job_id: ID задачи
+    :param params: параметры задачи
+    :param store: функция сохранения документа
+    :param collection: коллекция, в которую сохраняется документ
+    :return: ответ, который получил бы пользователь при обычной загрузке
+    """
+    async def progress(stage):
+        await Executors.pools.run_io(Jobs.job_queue.set_progress, job_id, stage)
+
+    stored = await Executors.pools.run_io(collection.find_one, {"job_id": job_id}, {"tags": 1})
+    if stored:
+        await Executors.pools.run_io(remove_job_file, params)
+        return {
+            "status": "success",
+            "message": "Документ сохранен предыдущей попыткой задачи",
+            "document_id": str(stored["_id"]),
+            "filename": params["file_name"],
+            "tags": stored.get("tags", [])
+        }
+
+    if not os.path.exists(params["spooled_path"]):
+        raise HTTPException(status_code=400, detail="Файл задачи не найден")
+
+    await progress("extracting")
+    content = await extract_upload_text(params["file_name"], params["spooled_path"], params["file_hash"])
+    return await store(
+        params["file_name"], content, params["file_hash"], params["spooled_path"],
+        list(params["tags"]), params["use_auto_tags"], params["user"], progress, job_id
+    )
+
+
+async def extract_upload_text(file_name, path, file_hash):
+    """
+    Извлекает текст из записанного на диск файла в пуле процессов
+    :param file_name: имя загруженного файла
+    :param path: путь к файлу на диске
+    :param file_hash: SHA-256 содержимого файла
+    :return: очищенный текст
+    """
+    cache_key = f"{file_hash}:{ReadFile.EXTRACTOR_VERSION}"
+    content = await Executors.pools.run_io(result_cache.get, "text", cache_key)
+    if content is None:
+        if file_name.endswith('.pdf'):
+            content = await extract_parts_text(path, Executors.iter_pdf_pages)
+        elif file_name.endswith('.xlsx') and Settings.XLSX_PARALLEL_SHEETS:
+            content = await extract_parts_text(path, Executors.iter_xlsx_sheets)
+        else:
+            content = await Executors.pools.run_cpu(Executors.extract_text_task, file_name, path)
+        await Executors.pools.run_io(result_cache.set, "text", cache_key, content)
+    return content
+
+
+async def extract_parts_text(path, iter_parts):
+    """
+    Извлекает текст файла по частям (страницам PDF или листам Excel) в пуле процессов
+    :param path: путь к файлу
+    :param iter_parts: асинхронный генератор текста частей файла по пути к нему
+    :return: очищенный текст
+    """
+    parts = [part async for part in iter_parts(path)]
+    return ReadFile.clean_text(" ".join(parts))
+
+
+async def tag_by_paragraphs(contents, vocabulary, vocabulary_key):
+    """
+    Генерирует теги по фрагментам текста. spaCy запускается только для фрагментов,
+    результаты анализа которых еще не сохранены в базе данных
+    :param contents: массив текстов документов
+    :param vocabulary: массив фраз словаря тегов
+    :param vocabulary_key: отпечаток словаря тегов
+    :return: массив массивов тегов в порядке входных текстов
+    """
+    key_suffix = f":{Settings.SPACY_MODEL}:{TAGGER_VERSION}:{vocabulary_key}"
+    paragraph_texts = {}
+    documents_keys = []
+    for content in contents:
+        keys = []
+        for paragraph in split_paragraphs(content):
+            key = paragraph_hash(paragraph) + key_suffix
+            paragraph_texts[key] = paragraph
+            keys.append(key)
+        documents_keys.append(keys)
+
+    analyses = await Executors.pools.run_io(mongoDB.get_paragraph_analyses, list(paragraph_texts.keys()))
+    missing = [key for key in paragraph_texts if key not in analyses]
+    if missing:
+        computed = await Executors.pools.run_cpu(
+            Executors.analyze_paragraphs_task, [paragraph_texts[key] for key in missing], vocabulary
+        )
+        new_analyses = dict(zip(missing, computed))
+        await Executors.pools.run_io(mongoDB.save_paragraph_analyses, new_analyses)
+        analyses.update(new_analyses)
+
+    tag_service = TagGenerate()
+    return [tag_service.combine_analyses([analyses[key] for key in keys]) for keys in documents_keys]
+
+
+async def generate_auto_tags_batch(contents, file_hashes):
+    """
+    Генерирует теги для текстов документов в пуле процессов. Результат кэшируется по SHA-256 файла,
+    версии модели и словаря тегов
+    :param contents: массив текстов документов
+    :param file_hashes: массив SHA-256 содержимого файлов
+    :return: массив массивов тегов в порядке входных текстов
+    """
+    vocabulary = await Executors.pools.run_io(tag_structure.get_tag_vocabulary)
+    vocabulary_key = fingerprint(vocabulary)
+    cache_keys = [
+        f"{file_hash}:{Settings.SPACY_MODEL}:{TAGGER_VERSION}:{vocabulary_key}" for file_hash in file_hashes
+    ]
+
+    results = [await Executors.pools.run_io(result_cache.get, "tags", key) for key in cache_keys]
+    missing = [i for i, tags in enumerate(results) if tags is None]
+    computed = []
+    if missing:
+        computed = await tag_by_paragraphs([contents[i] for i in missing], vocabulary, vocabulary_key)
+
+    for i, tags in zip(missing, computed):
+        results[i] = tags
+        await Executors.pools.run_io(result_cache.set, "tags", cache_keys[i], tags)
+    return results
+
+
+async def generate_auto_tags(content, file_hash):
+    """
+    Генерирует теги для текста документа
+    :param content: текст документа
+    :param file_hash: SHA-256 содержимого файла
+    :return: массив тегов
+    """
+    return (await generate_auto_tags_batch([content], [file_hash]))[0]
+
+
+async def prepare_batch(files: List[UploadFile], selected_tags, use_auto_tags):
+    """
+    Параллельно (не более BATCH_FILE_CONCURRENCY файлов одновременно) извлекает текст из пакета файлов,
+    сохраняет файлы и формирует теги
+    :param files: загруженные файлы
+    :param selected_tags: теги, выбранные пользователем
+    :param use_auto_tags: добавлять ли автоматически сгенерированные теги
+    :return: отчет по файлам, документы для записи в базу и соответствующие им записи отчета
+    """
+    semaphore = asyncio.Semaphore(Settings.BATCH_FILE_CONCURRENCY)
+
+    async def receive(file):
+        async with semaphore:
+            return await receive_upload_text(file)
+
+    extracted = await asyncio.gather(*(receive(file) for file in files), return_exceptions=True)
+
+    report = []
+    documents = []
+    entries = []
+    file_hashes = []
+    for file, result in zip(files, extracted):
+        entry = {"filename": file.filename}
+        report.append(entry)
+        if isinstance(result, Exception):
+            entry.update({"status": "error", "detail": str(result)})
+            continue
+        content, file_hash, file_path = result
+        file_hashes.append(file_hash)
+        documents.append({
+            "title": file.filename,
+            "content": content,
+            "file_path": file_path,
+            "file_hash": file_hash,
+            "tags": list(selected_tags)
+        })
+        entries.append(entry)
+
+    if use_auto_tags and documents:
+        auto_tags_batch = await generate_auto_tags_batch([doc["content"] for doc in documents], file_hashes)
+        for doc, auto_tags in zip(documents, auto_tags_batch):
+            doc["tags"].extend(tag for tag in auto_tags if tag not in doc["tags"])
+
+    for doc in documents:
+        if not doc["tags"]:
+            doc["tags"].append(Path(doc["title"]).stem.lower())
+        doc["tags"] = list(set(doc["tags"]))
+
+    return report, documents, entries
+
+
+@app.on_event("startup")
+def warm_up_models():
+    NlpModels.lemma_cache.load()
+    NlpModels.registry.warm_up()
+    Executors.pools.start()
+    mongoDB.ensure_indexes()
+    Moderation.ensure_indexes()
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    Jobs.job_queue.register(
+        "upload", functools.partial(run_upload_job, store=store_document, collection=mongoDB.docs_collection),
+        remove_job_file
+    )
+    Jobs.job_queue.register(
+        "upload_for_moderation", functools.partial(
+            run_upload_job, store=store_document_for_moderation, collection=Moderation.moderation_collection
+        ),
+        remove_job_file
+    )
+    await Executors.pools.run_io(Jobs.job_queue.ensure_indexes)
+    Jobs.job_queue.start()
+
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await Jobs.job_queue.stop()
+
+
+@app.on_event("shutdown")
+def save_lemma_cache():
+    NlpModels.lemma_cache.save()
+    Executors.pools.shutdown()
+
 
 @app.post("/upload_for_moderation", response_model=dict)
 async def upload_document_for_moderation(
@@ -64,55 +416,76 @@ async def upload_document_for_moderation(
             description="Добавить автоматически сгенерированные теги"
         ),
         user: str = Form("student"),
+        background: bool = Form(
+            False,
+            description="Обработать документ в фоновой задаче и сразу вернуть ID задачи"
+        ),
 ):
     """Загрузить документ на модерацию"""
     try:
-        content = ""
-        if file.filename.endswith('.pdf'):
-            content = await ReadFile.extract_pdf_text(file.file)
-        elif file.filename.endswith('.docx'):
-            content = await ReadFile.extract_docx_text(file.file)
-        elif file.filename.endswith('.xlsx'):
-            content = await ReadFile.extract_xlsx_text(file.file)
-
-        content = ReadFile.clean_text(content) if content else ""
-        file_path = save_file_to_server(file)
-
-        final_tags = []
-
-        if content_tags:
-            final_tags.extend(tag.strip() for tag in content_tags if tag.strip())
-        if program_track_tags:
-            final_tags.extend(tag.strip() for tag in program_track_tags if tag.strip())
-        if doc_type_tags:
-            final_tags.extend(tag.strip() for tag in doc_type_tags if tag.strip())
-        if other_tags:
-            final_tags.extend(tag.strip() for tag in other_tags if tag.strip())
-
-        if use_auto_tags:
-            tag_service = TagGenerate()
-            auto_tags = tag_service.extract_keywords(content)
-            final_tags.extend(tag for tag in auto_tags if tag not in final_tags)
-
-        if not final_tags:
-            final_tags.append(Path(file.filename).stem.lower())
-
-        final_tags = list(set(final_tags))
-
-        doc_id = Moderation.upload_document_to_moderation(
-            file.filename, content, file_path, user, final_tags
-        )
-        return {
-            "status": "OK",
-            "message": "Документ отправлен на модерацию",
-            "document_id": str(doc_id),
-            "filename": file.filename,
-            "tags": final_tags
-        }
+        final_tags = collect_selected_tags(content_tags, program_track_tags, doc_type_tags, other_tags)
+
+        if background:
+            return await submit_upload_job("upload_for_moderation", file, final_tags, use_auto_tags, user)
+
+        return await receive_and_store(file, store_document_for_moderation, final_tags, use_auto_tags, user)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def store_document_for_moderation(file_name, content, file_hash, spooled_path, final_tags, use_auto_tags,
+                                        user, progress=None, job_id=None):
+    """
+    Генерирует теги и отправляет документ на модерацию
+    :param file_name: имя файла
+    :param content: текст документа
+    :param file_hash: SHA-256 содержимого файла
+    :param spooled_path: путь к временному файлу, который переносится в каталог загрузок
+    :param final_tags: теги, выбранные пользователем
+    :param use_auto_tags: добавлять ли автоматически сгенерированные теги
+    :param user: пользователь, загрузивший документ
+    :param progress: асинхронная функция, получающая название текущего этапа
+    :param job_id: ID фоновой задачи, сохраняющей документ
+    :return: ответ для пользователя
+    """
+    if use_auto_tags:
+        if progress:
+            await progress("tagging")
+        auto_tags = await generate_auto_tags(content, file_hash)
+        final_tags.extend(tag for tag in auto_tags if tag not in final_tags)
+
+    if not final_tags:
+        final_tags.append(Path(file_name).stem.lower())
+
+    final_tags = list(set(final_tags))
+
+    if progress:
+        await progress("saving")
+    minhash_fields = await Executors.pools.run_cpu(MinHash.document_fields, content)
+    near_duplicates = await Executors.pools.run_io(
+        mongoDB.find_near_duplicates, content, [mongoDB.docs_collection, Moderation.moderation_collection],
+        minhash_fields
+    )
+
+    file_path = await move_to_uploads(Moderation.moderation_collection, file_name, spooled_path, content, file_hash)
+    doc_id = await Executors.pools.run_io(
+        Moderation.upload_document_to_moderation, file_name, content, file_path, user, final_tags, file_hash, job_id,
+        minhash_fields
+    )
+    if not doc_id:
+        raise HTTPException(status_code=400, detail="Документ уже существует в базе данных")
+    return {
+        "status": "OK",
+        "message": "Документ отправлен на модерацию",
+        "document_id": str(doc_id),
+        "filename": file_name,
+        "tags": final_tags,
+        "near_duplicates": near_duplicates
+    }
+
+
 @app.get("/moderation/documents")
 async def get_documents_for_moderation(
         status: str = Query(None, description="Статус модерации (pending, approved, rejected)"),
@@ -122,7 +495,7 @@ async def get_documents_for_moderation(
     if admin != "admin":
         raise HTTPException(status_code=403, detail="Доступ запрещен")
 
-    documents = Moderation.get_moderation_documents(status)
+    documents = await Executors.pools.run_io(Moderation.get_moderation_documents, status)
     for doc in documents:
         doc["_id"] = str(doc["_id"])
     return JSONResponse(documents)
@@ -138,7 +511,12 @@ async def approve_moderation_document(
     if admin != "admin":
         raise HTTPException(status_code=403, detail="Доступ запрещен")
 
-    success = Moderation.approve_document(doc_id, admin, final_tags)
+    document = await Executors.pools.run_io(Moderation.get_moderation_document, doc_id)
+    if not document:
+        raise HTTPException(status_code=400, detail="Не удалось одобрить документ")
+    terms = (await Executors.pools.run_cpu(Executors.extract_terms_task, [document["content"]]))[0]
+
+    success = await Executors.pools.run_io(Moderation.approve_document, doc_id, admin, final_tags, terms)
     if success:
         return {"status": "OK", "message": "Документ одобрен и добавлен в основную базу"}
     else:
@@ -154,7 +532,7 @@ async def reject_moderation_document(
     if admin != "admin":
         raise HTTPException(status_code=403, detail="Доступ запрещен")
 
-    success = Moderation.reject_document(doc_id, admin)
+    success = await Executors.pools.run_io(Moderation.reject_document, doc_id, admin)
     if success:
         return {"status": "OK", "message": "Документ отклонен"}
     else:
@@ -164,17 +542,8 @@ async def reject_moderation_document(
 async def document_tags(file: UploadFile = File(...)):
     """Анализирует документ и возвращает список тегов"""
     try:
-        content = ""
-        if file.filename.endswith('.pdf'):
-            content = await ReadFile.extract_pdf_text(file.file)
-        elif file.filename.endswith('.docx'):
-            content = await ReadFile.extract_docx_text(file.file)
-        elif file.filename.endswith('.xlsx'):
-            content = await ReadFile.extract_xlsx_text(file.file)
-
-        content = ReadFile.clean_text(content) if content else ""
-        tag_service = TagGenerate()
-        auto_tags = tag_service.extract_keywords(content)
+        content, file_hash, _ = await receive_upload_text(file, keep=False)
+        auto_tags = await generate_auto_tags(content, file_hash)
 
         return JSONResponse({
             "filename": file.filename,
@@ -182,6 +551,8 @@ async def document_tags(file: UploadFile = File(...)):
             "auto_tags": auto_tags
         })
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -210,79 +581,219 @@ async def upload_document(
             description="Добавить автоматически сгенерированные теги"
         ),
         user: str = Form("admin"),
+        background: bool = Form(
+            False,
+            description="Обработать документ в фоновой задаче и сразу вернуть ID задачи"
+        ),
 ):
     """Загрузить документ с выбранными тегами (только для администраторов)"""
     if user != "admin":
         raise HTTPException(status_code=403, detail="Доступ запрещен")
 
-    content = ""
-    if file.filename.endswith('.pdf'):
-        content = await ReadFile.extract_pdf_text(file.file)
-    elif file.filename.endswith('.docx'):
-        content = await ReadFile.extract_docx_text(file.file)
-    elif file.filename.endswith('.xlsx'):
-        content = await ReadFile.extract_xlsx_text(file.file)
+    final_tags = collect_selected_tags(content_tags, program_track_tags, doc_type_tags, other_tags)
 
-    content = ReadFile.clean_text(content) if content else ""
-    file_path = save_file_to_server(file)
+    if background:
+        return await submit_upload_job("upload", file, final_tags, use_auto_tags, user)
 
-    final_tags = []
+    return await receive_and_store(file, store_document, final_tags, use_auto_tags, user)
 
-    if content_tags:
-        final_tags.extend(tag.strip() for tag in content_tags if tag.strip())
-    if program_track_tags:
-        final_tags.extend(tag.strip() for tag in program_track_tags if tag.strip())
-    if doc_type_tags:
-        final_tags.extend(tag.strip() for tag in doc_type_tags if tag.strip())
-    if other_tags:
-        final_tags.extend(tag.strip() for tag in other_tags if tag.strip())
+
+async def store_document(file_name, content, file_hash, spooled_path, final_tags, use_auto_tags, user, progress=None,
+                         job_id=None):
+    """
+    Генерирует теги и сохраняет документ в основное хранилище
+    :param file_name: имя файла
+    :param content: текст документа
+    :param file_hash: SHA-256 содержимого файла
+    :param spooled_path: путь к временному файлу, который переносится в каталог загрузок
+    :param final_tags: теги, выбранные пользователем
+    :param use_auto_tags: добавлять ли автоматически сгенерированные теги
+    :param user: пользователь, загрузивший документ
+    :param progress: асинхронная функция, получающая название текущего этапа
+    :param job_id: ID фоновой задачи, сохраняющей документ
+    :return: ответ для пользователя
+    """
     selected_tags= [final_tags]
 
     if use_auto_tags:
-        tag_service = TagGenerate()
-        auto_tags = tag_service.extract_keywords(content)
+        if progress:
+            await progress("tagging")
+        auto_tags = await generate_auto_tags(content, file_hash)
         final_tags.extend(tag for tag in auto_tags if tag not in final_tags)
 
 
     if not final_tags:
-        final_tags.append(Path(file.filename).stem.lower())
+        final_tags.append(Path(file_name).stem.lower())
 
     # Удаляем дубликаты
     final_tags = list(set(final_tags))
 
+    if progress:
+        await progress("saving")
+    minhash_fields = await Executors.pools.run_cpu(MinHash.document_fields, content)
+    near_duplicates = await Executors.pools.run_io(mongoDB.find_near_duplicates, content, None, minhash_fields)
+    terms = (await Executors.pools.run_cpu(Executors.extract_terms_task, [content]))[0]
+
+    file_path = await move_to_uploads(mongoDB.docs_collection, file_name, spooled_path, content, file_hash)
+
     # Сохраняем в БД (моделируем вызов)
-    doc_id = mongoDB.upload_document_to_db(file.filename, content, file_path, user=user,
-                                           tags=final_tags)
+    doc_id = await Executors.pools.run_io(
+        functools.partial(
+            mongoDB.upload_document_to_db, user=user, tags=final_tags, file_hash=file_hash, terms=terms, job_id=job_id,
+            minhash_fields=minhash_fields
+        ),
+        file_name, content, file_path
+    )
     if not doc_id:
         raise HTTPException(status_code=400, detail="Документ уже существует в базе данных")
     return {
         "status": "success",
         "document_id": str(doc_id),
-        "filename": file.filename,
+        "filename": file_name,
         "selected_tags": selected_tags,
         "auto_tags_used": use_auto_tags,
-        "final_tags": final_tags
+        "final_tags": final_tags,
+        "near_duplicates": near_duplicates
+    }
+
+
+@app.post("/upload_batch", response_model=dict)
+async def upload_documents_batch(
+        files: List[UploadFile] = File(...),
+        content_tags: List[str] = Query(
+            CONTENT_TAGS,
+            description="Выберите теги из списка"
+        ),
+        program_track_tags: List[str] = Query(
+            PROGRAM_TAGS,
+            description="Выберите теги из списка"
+        ),
+        doc_type_tags: List[str] = Query(
+            DOC_TYPE_TAGS,
+            description="Выберите теги из списка"
+        ),
+        other_tags: List[str] = Query(
+            OTHER_TAGS,
+            description="Выберите теги из списка"
+        ),
+        use_auto_tags: bool = Form(
+            True,
+            description="Добавить автоматически сгенерированные теги"
+        ),
+        user: str = Form("admin"),
+):
+    """Загрузить пакет документов с выбранными тегами (только для администраторов)"""
+    if user != "admin":
+        raise HTTPException(status_code=403, detail="Доступ запрещен")
+
+    selected_tags = collect_selected_tags(content_tags, program_track_tags, doc_type_tags, other_tags)
+    report, documents, entries = await prepare_batch(files, selected_tags, use_auto_tags)
+    if documents:
+        terms = await Executors.pools.run_cpu(Executors.extract_terms_task, [doc["content"] for doc in documents])
+        for doc, doc_terms in zip(documents, terms):
+            doc["terms"] = doc_terms
+
+    results = await Executors.pools.run_io(mongoDB.upload_documents_to_db, documents, user)
+    for entry, doc, (doc_id, error) in zip(entries, documents, results):
+        entry["tags"] = doc["tags"]
+        entry["document_id"] = str(doc_id) if doc_id else None
+        if doc_id is None:
+            entry.update({"status": "duplicate", "detail": error})
+        elif error:
+            entry.update({"status": "error", "detail": error})
+        else:
+            entry["status"] = "success"
+
+    return {
+        "status": "success",
+        "uploaded": sum(1 for entry in report if entry["status"] == "success"),
+        "total": len(report),
+        "files": report
+    }
+
+
+@app.post("/upload_batch_for_moderation", response_model=dict)
+async def upload_documents_batch_for_moderation(
+        files: List[UploadFile] = File(...),
+        content_tags: List[str] = Query(
+            CONTENT_TAGS,
+            description="Выберите теги из списка"
+        ),
+        program_track_tags: List[str] = Query(
+            PROGRAM_TAGS,
+            description="Выберите теги из списка"
+        ),
+        doc_type_tags: List[str] = Query(
+            DOC_TYPE_TAGS,
+            description="Выберите теги из списка"
+        ),
+        other_tags: List[str] = Query(
+            OTHER_TAGS,
+            description="Выберите теги из списка"
+        ),
+        use_auto_tags: bool = Form(
+            True,
+            description="Добавить автоматически сгенерированные теги"
+        ),
+        user: str = Form("student"),
+):
+    """Загрузить пакет документов на модерацию"""
+    selected_tags = collect_selected_tags(content_tags, program_track_tags, doc_type_tags, other_tags)
+    report, documents, entries = await prepare_batch(files, selected_tags, use_auto_tags)
+
+    results = await Executors.pools.run_io(Moderation.upload_documents_to_moderation, documents, user)
+    for entry, doc, doc_id in zip(entries, documents, results):
+        entry["tags"] = doc["tags"]
+        entry["document_id"] = str(doc_id) if doc_id else None
+        if doc_id is None:
+            entry.update({"status": "duplicate", "detail": "Документ уже существует в базе данных"})
+        else:
+            entry["status"] = "OK"
+
+    return {
+        "status": "OK",
+        "message": "Документы отправлены на модерацию",
+        "uploaded": sum(1 for entry in report if entry["status"] == "OK"),
+        "total": len(report),
+        "files": report
     }
 
 
 @app.get("/search",  summary="Найти документ по запросу")
-async def search(query: str):
+async def search(query: str, response: Response, mode: str = "tags",
+                 limit: int = Settings.SEARCH_DEFAULT_LIMIT, cursor: str = None):
+    """
+    Режимы поиска: tags - по тегам, fulltext - по тексту документов (BM25), hybrid - смешанный.
+    Курсор следующей страницы возвращается в заголовке X-Next-Cursor
+    """
     _search = SearchFunction()
-    result = _search.search_by_tag(query)
+    result, next_cursor = await Executors.pools.run_io(_search.search, query, mode, limit, cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return result
 
 
 @app.get("/get_document")
 async def get_document(file_id: str):
-    doc = mongoDB.get_document_db(file_id)
+    doc = await Executors.pools.run_io(mongoDB.get_document_db, file_id)
     if doc:
         return doc.get("content")
     else:
         raise HTTPException(status_code=404, detail="Документ не найден")
 
+@app.get("/similar_documents", summary="Найти похожие документы")
+async def similar_documents(file_id: str, threshold: float = Settings.NEAR_DUPLICATE_THRESHOLD, limit: int = 10):
+    """
+    Находит документы, текст которых почти совпадает с текстом указанного документа
+    """
+    similar = await Executors.pools.run_io(mongoDB.find_similar_documents, file_id, threshold, limit)
+    if similar is None:
+        raise HTTPException(status_code=404, detail="Документ не найден")
+    return similar
+
 @app.get("/download_document")        #через swagger работает
 async def download_document(file_id: str):
-    document = mongoDB.get_document_db(file_id)
+    document = await Executors.pools.run_io(mongoDB.get_document_db, file_id)
     if document and os.path.exists(document['file_path']):
         return FileResponse(document['file_path'], filename=document['title'])
     else:
@@ -292,11 +803,11 @@ async def download_document(file_id: str):
 async def delete_document(file_id: str,user: str = Form("user")):
     if user != "admin":
         raise HTTPException(status_code=403, detail="Доступ запрещен")
-    document = mongoDB.get_document_db(file_id)
+    document = await Executors.pools.run_io(mongoDB.get_document_db, file_id)
     if document:
         if os.path.exists(document['file_path']):
             os.remove(document['file_path'])
-        deleted_count = mongoDB.delete_document_db(file_id)
+        deleted_count = await Executors.pools.run_io(mongoDB.delete_document_db, file_id)
         if deleted_count > 0:
             return {"message": "Документ успешно удален"}
         else:
@@ -309,24 +820,31 @@ async def delete_document(file_id: str,user: str = Form("user")):
 async def update_document(file_id: str, file: UploadFile,user: str = Form("user")):
     if user != "admin":
         raise HTTPException(status_code=403, detail="Доступ запрещен")
-    document = mongoDB.get_document_db(file_id)
+    document = await Executors.pools.run_io(mongoDB.get_document_db, file_id)
     if document:
-        content = ""
-        if file.filename.endswith('.pdf'):
-            content = ReadFile.extract_pdf_text(file.file)
-        elif file.filename.endswith('.docx'):
-            content = ReadFile.extract_docx_text(file.file)
-        elif file.filename.endswith('.xlsx'):
-            content = ReadFile.extract_xlsx_text(file.file)
-        tag_service = TagGenerate()
-        tags = tag_service.extract_keywords(content)
-
-        if os.path.exists(document['file_path']):
-            os.remove(document['file_path'])
-
-        new_file_path = save_file_to_server(file)
-
-        modified_count = mongoDB.update_document_db(file_id, content, new_file_path, tags)
+        spooled_path, file_hash = await spool_upload(file)
+        try:
+            content = await extract_upload_text(file.filename, spooled_path, file_hash)
+            # Проверяем дубликаты до замены файла, чтобы не затереть файл другого документа
+            duplicate = await Executors.pools.run_io(
+                mongoDB.find_duplicate, mongoDB.docs_collection, document["title"], upload_path(file.filename),
+                content, file_hash, document["_id"]
+            )
+            if duplicate:
+                raise HTTPException(status_code=409, detail="Документ с таким файлом или содержимым уже существует")
+            tags = await generate_auto_tags(content, file_hash)
+            terms = (await Executors.pools.run_cpu(Executors.extract_terms_task, [content]))[0]
+            new_file_path = await Executors.pools.run_io(
+                save_file_to_server, file.filename, spooled_path, document['file_path']
+            )
+        finally:
+            if os.path.exists(spooled_path):
+                os.remove(spooled_path)
+
+        modified_count = await Executors.pools.run_io(
+            functools.partial(mongoDB.update_document_db, new_file_hash=file_hash, new_terms=terms),
+            file_id, content, new_file_path, tags
+        )
         if modified_count > 0:
             return {"message": "Документ успешно обновлен"}
         else:
@@ -443,6 +961,70 @@ def set_limit(limit: int):
     return {"message": "Global limit updated", "limit": limit}
 
 
+@app.get("/jobs/{job_id}", summary="Состояние фоновой задачи")
+async def get_job(job_id: str):
+    """
+    Возвращает этап обработки фоновой задачи, число попыток и результат
+    """
+    job = await Executors.pools.run_io(Jobs.job_queue.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return {
+        "job_id": str(job["_id"]),
+        "kind": job["kind"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "attempts": job["attempts"],
+        "max_attempts": job["max_attempts"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"].isoformat(),
+        "updated_at": job["updated_at"].isoformat(),
+        "finished_at": job["finished_at"].isoformat() if job["finished_at"] else None
+    }
+
+
+@app.get("/metrics", summary="Метрики кэшей и пулов исполнителей")
+def metrics():
+    """
+    Возвращает статистику кэшей и пулов исполнителей процесса
+    """
+    return {
+        "executors": Executors.pools.stats(),
+        "mongo_pool": Database.pool_metrics.stats(),
+        "lemma_cache": NlpModels.lemma_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "config_cache": mongoDB.config_cache.stats(),
+        "search_cache": mongoDB.search_cache.stats(),
+        "jobs": Jobs.job_queue.stats()
+    }
+
+
+@app.get("/models/info", summary="Информация о загруженных NLP-моделях")
+def models_info():
+    """
+    Возвращает время загрузки моделей и потребление памяти процессом
+    """
+    info = NlpModels.registry.info()
+    info["executors"] = Executors.pools.stats()
+    return info
+
+
+@app.post("/models/reload", summary="Перезагрузить NLP-модели")
+def models_reload(admin: str = Query(..., description="Имя администратора")):
+    """
+    Перезагружает spaCy-пайплайн и морфологический анализатор в основном процессе и в пуле процессов
+    :param admin: имя администратора
+    """
+    if admin != "admin":
+        raise HTTPException(status_code=403, detail="Доступ запрещен")
+    info = NlpModels.registry.reload()
+    # Кэш лемм очищен при перезагрузке: сохраняем его, чтобы новые процессы не загрузили старые леммы
+    NlpModels.lemma_cache.save()
+    Executors.pools.restart_cpu()
+    return info
+
+
 if __name__ == '__main__':
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=8000)
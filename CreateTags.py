@@ -1,58 +1,120 @@
-import spacy
-import pymorphy3
-
+import hashlib
+import re
+import threading
+import zlib
+
+import NlpModels
+import Settings
+from PhraseMatcher import PhraseMatcher
 from mongoDB import TagStructure
 
+# Версия алгоритма генерации тегов, входит в ключ кэша результатов
+TAGGER_VERSION = 1
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?…;])\s+')
+
+
+def split_paragraphs(text, max_chars=Settings.TAGGING_CHUNK_CHARS, boundary=Settings.PARAGRAPH_SENTENCES):
+    """
+    Делит текст на фрагменты по границам предложений, чтобы не строить один огромный Doc.
+    Граница фрагмента определяется содержимым предложения, поэтому правка одного места текста
+    меняет только соседние фрагменты
+    :param text: текст документа
+    :param max_chars: максимальная длина фрагмента в символах
+    :param boundary: среднее количество предложений во фрагменте
+    :return: генератор фрагментов текста
+    """
+    chunk = []
+    chunk_len = 0
+    for sentence in SENTENCE_BOUNDARY.split(text):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            if chunk:
+                yield " ".join(chunk)
+                chunk, chunk_len = [], 0
+            yield sentence[:cut]
+            sentence = sentence[cut:].lstrip()
+        if not sentence:
+            continue
+        if chunk and chunk_len + len(sentence) + 1 > max_chars:
+            yield " ".join(chunk)
+            chunk, chunk_len = [], 0
+        chunk.append(sentence)
+        chunk_len += len(sentence) + 1
+        if zlib.crc32(sentence.encode("utf-8")) % boundary == 0:
+            yield " ".join(chunk)
+            chunk, chunk_len = [], 0
+    if chunk:
+        yield " ".join(chunk)
+
+
+def paragraph_hash(paragraph):
+    return hashlib.sha256(paragraph.encode("utf-8")).hexdigest()
+
 
 class TagGenerate:
     """
     Класс функций для извлечения тегов из текста документа
     """
 
+    _matcher_lock = threading.Lock()
+    _matcher_key = None
+    _matcher = None
+
     def __init__(self):
-        self.nlp = spacy.load('ru_core_news_sm')
-        self.morph = pymorphy3.MorphAnalyzer()
+        self.nlp = NlpModels.registry.get_nlp()
+        self.morph = NlpModels.registry.get_morph()
 
 
-    def get_candidates(self, text):
+    def phrase_lemmas(self, phrase):
         """
-        Возвращает словарь фраз и слов - возможных тегов с индексами их вхождения
-        :param text: текст документа, обработанный с помощью spacy
-        :return: массив тегов
+        Разбивает фразу на токены spacy и приводит каждый токен к именительному падежу
+        :param phrase: фраза словаря
+        :return: массив нормальных форм токенов
         """
-        candidates = {}
-        candidates_tokens = []
-
-        for i in range(0, len(text)):
-            token = text[i]
-
-            if token.pos_ == "NOUN":
-                candidates.setdefault(self.to_nominative_case(token.text.lower()), []).append(i)
-            if token.pos_ in ("ADJ", "NOUN", "PROPN"):
-                candidates_tokens.append(self.to_nominative_case(token.text.lower()))
-            else:
-                if len(candidates_tokens) == 2:
-                    cand_phrase = " ".join(candidates_tokens)
-                    candidates.setdefault(cand_phrase, []).append(i - 2)
-                    candidates_tokens = []
-                else:
-                    candidates_tokens = []
-
-        if len(candidates_tokens) == 2:
-            cand_phrase = " ".join(candidates_tokens)
-            candidates.setdefault(cand_phrase, []).append(len(text)-2)
+        return [self.to_nominative_case(token.text.lower()) for token in self.nlp.make_doc(phrase) if not token.is_space]
 
+
+    def get_matcher(self, vocabulary):
+        """
+        Возвращает автомат для поиска фраз словаря. Автомат перестраивается только при изменении словаря
+        :param vocabulary: массив фраз словаря тегов
+        :return: автомат PhraseMatcher
+        """
+        key = (id(self.nlp), tuple(vocabulary))
+        with TagGenerate._matcher_lock:
+            if TagGenerate._matcher_key != key:
+                matcher = PhraseMatcher()
+                for phrase in vocabulary:
+                    matcher.add(self.phrase_lemmas(phrase), phrase)
+                matcher.build()
+                TagGenerate._matcher = matcher
+                TagGenerate._matcher_key = key
+            return TagGenerate._matcher
+
+
+    def match_candidates(self, doc, matcher):
+        """
+        Возвращает словарь фраз словаря, найденных в тексте, с индексами их вхождения
+        :param doc: текст документа, обработанный с помощью spacy
+        :param matcher: автомат для поиска фраз словаря
+        :return: словарь, где ключ - фраза словаря, значение - массив индексов вхождения
+        """
+        lemmas = [self.to_nominative_case(token.text.lower()) for token in doc]
+        candidates = {}
+        for start, length, phrase in matcher.iter_matches(lemmas):
+            candidates.setdefault(phrase, []).append(start)
         return candidates
 
 
-    def feature_counting(self, candidates, doc_text):
+    def feature_counting(self, candidates, total_tokens):
         """
         Подсчитывает вероятность, что кандидат является тегом
         :param candidates: список кандидатов
-        :param doc_text: текст документа, обработанный spacy
+        :param total_tokens: количество токенов в документе
         :return: словарь, где ключ - кандидат, значение - словарь с полями: частота, первое вхождение, вероятность
         """
-        total_tokens = len(doc_text)
         features = {}
 
         for candidate, positions in candidates.items():
@@ -69,6 +131,18 @@ class TagGenerate:
         return features
 
 
+    def word_to_nominative(self, word):
+        """
+        Приводит одно слово к именительному падежу единственного числа
+        :param word: входное слово
+        :return: слово в именительном падеже
+        """
+        word_norm = self.morph.parse(word)[0].inflect({'sing', 'nomn'})
+        if word_norm:
+            return word_norm.word
+        return word
+
+
     def to_nominative_case(self, phrase):
         """
         Приводит фразу к именительному падежу слова
@@ -80,35 +154,102 @@ class TagGenerate:
         nominative_words = []
 
         for word in words:
-            word_norm = self.morph.parse(word)[0].inflect({'sing', 'nomn'})
-            if word_norm:
-                nominative_words.append(word_norm.word)
-            else:
-                nominative_words.append(word)
+            nominative_words.append(NlpModels.lemma_cache.get(word, self.word_to_nominative))
 
         if len(nominative_words) == 0:
             return ""
         return " ".join(nominative_words)
 
 
-    def extract_keywords(self, text, num_keywords=5):
+    def rank_candidates(self, candidates, total_tokens, num_keywords=5):
+        """
+        Упорядочивает найденные фразы словаря по вероятности быть тегом
+        :param candidates: словарь кандидатов с индексами вхождения
+        :param total_tokens: количество токенов в документе
+        :param num_keywords: количество ключевых слов в результате
+        :return: массив ключевых слов
+        """
+        candidates_features = self.feature_counting(candidates, total_tokens)
+        sorted_candidates = sorted(candidates_features.items(), key=lambda x: x[1]["score"], reverse = True)
+
+        return [candidate for candidate, feature in sorted_candidates][:num_keywords]
+
+
+    def analyze_paragraphs(self, paragraphs, vocabulary, batch_size=Settings.TAGGING_BATCH_SIZE,
+                           n_process=Settings.TAGGING_N_PROCESS):
+        """
+        Находит фразы словаря в каждом фрагменте текста отдельно
+        :param paragraphs: массив фрагментов текста
+        :param vocabulary: массив фраз словаря тегов
+        :param batch_size: размер пакета spacy
+        :param n_process: количество процессов spacy
+        :return: массив словарей с полями: tokens - количество токенов, candidates - пары (фраза, индексы вхождения)
+        """
+        matcher = self.get_matcher(vocabulary)
+        if len(paragraphs) <= batch_size:
+            n_process = 1
+        return [
+            {"tokens": len(doc), "candidates": list(self.match_candidates(doc, matcher).items())}
+            for doc in self.nlp.pipe(paragraphs, batch_size=batch_size, n_process=n_process,
+                                     disable=self.nlp.pipe_names)
+        ]
+
+
+    def combine_analyses(self, analyses, num_keywords=5):
+        """
+        Объединяет результаты анализа фрагментов в признаки всего документа и выбирает ключевые слова
+        :param analyses: результаты analyze_paragraphs в порядке следования фрагментов
+        :param num_keywords: количество ключевых слов в результате
+        :return: массив ключевых слов
+        """
+        candidates = {}
+        total_tokens = 0
+        for analysis in analyses:
+            for phrase, positions in analysis["candidates"]:
+                candidates.setdefault(phrase, []).extend(pos + total_tokens for pos in positions)
+            total_tokens += analysis["tokens"]
+        return self.rank_candidates(candidates, total_tokens, num_keywords)
+
+
+    def extract_keywords(self, text, num_keywords=5, vocabulary=None):
         """
         Функция извлечения ключевого слова из текста
         :param text: текст документа
         :param num_keywords: количество ключевых слов в результате
+        :param vocabulary: массив фраз словаря тегов, по умолчанию читается из базы данных
         :return: массив ключевых слов
         """
-        doc = self.nlp(text)
-        candidates = self.get_candidates(doc)
-        candidates_features = self.feature_counting(candidates, doc)
-        sorted_candidates = sorted(candidates_features.items(), key=lambda x: x[1]["score"], reverse = True)
+        return self.extract_keywords_batch([text], num_keywords, vocabulary, n_process=1)[0]
 
-        answer = []
-        tag_structure = TagStructure()
-        other_tags = tag_structure.get_dict_by_name("other_tags")
-        for candidate, feature in sorted_candidates:
-            tag = self.to_nominative_case(candidate)
-            if (tag) and (tag not in answer) and (tag in other_tags):
-                answer.append(tag)
 
-        return answer[:num_keywords]
+    def extract_keywords_batch(self, texts, num_keywords=5, vocabulary=None,
+                               batch_size=Settings.TAGGING_BATCH_SIZE, n_process=Settings.TAGGING_N_PROCESS):
+        """
+        Извлекает ключевые слова из нескольких текстов за один пакетный проход nlp.pipe.
+        Тексты обрабатываются фрагментами, признаки кандидатов объединяются по всему документу
+        :param texts: массив текстов документов
+        :param num_keywords: количество ключевых слов для каждого документа
+        :param vocabulary: массив фраз словаря тегов, по умолчанию читается из базы данных
+        :param batch_size: размер пакета spacy
+        :param n_process: количество процессов spacy
+        :return: массив массивов ключевых слов в порядке входных текстов
+        """
+        if vocabulary is None:
+            vocabulary = TagStructure().get_tag_vocabulary()
+        matcher = self.get_matcher(vocabulary)
+        texts = list(texts)
+
+        candidates = [{} for _ in texts]
+        total_tokens = [0 for _ in texts]
+        chunks = ((chunk, i) for i, text in enumerate(texts) for chunk in split_paragraphs(text))
+        # Поиск фраз использует только текст токенов, поэтому компоненты пайплайна после токенизатора отключены
+        for doc, i in self.nlp.pipe(chunks, as_tuples=True, batch_size=batch_size, n_process=n_process,
+                                    disable=self.nlp.pipe_names):
+            for phrase, positions in self.match_candidates(doc, matcher).items():
+                candidates[i].setdefault(phrase, []).extend(pos + total_tokens[i] for pos in positions)
+            total_tokens[i] += len(doc)
+
+        return [
+            self.rank_candidates(doc_candidates, doc_tokens, num_keywords)
+            for doc_candidates, doc_tokens in zip(candidates, total_tokens)
+        ]
@@ -0,0 +1,129 @@
+import threading
+
+from pymongo import MongoClient, monitoring
+
+import Settings
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    Собирает метрики пула соединений MongoDB
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open_connections = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+
+    def _change(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._change(pool_clears=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._change(open_connections=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._change(open_connections=-1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._change(checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._change(checked_out=1, checkouts=1)
+
+    def connection_checked_in(self, event):
+        self._change(checked_out=-1)
+
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_pool_size": Settings.MONGO_MAX_POOL_SIZE,
+                "open_connections": self.open_connections,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "utilization": round(self.checked_out / Settings.MONGO_MAX_POOL_SIZE, 3),
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "pool_clears": self.pool_clears
+            }
+
+
+pool_metrics = PoolMetrics()
+
+_lock = threading.Lock()
+_client = None
+
+
+def create_client(uri=Settings.MONGO_URI):
+    """
+    Создает клиент MongoDB с настройками пула соединений.
+    Адрес вида mongomock:// создает хранилище в памяти (нужен пакет mongomock)
+    :param uri: адрес подключения
+    :return: клиент MongoDB
+    """
+    if uri.startswith("mongomock://"):
+        import mongomock
+        return mongomock.MongoClient()
+    return MongoClient(
+        uri,
+        maxPoolSize=Settings.MONGO_MAX_POOL_SIZE,
+        minPoolSize=Settings.MONGO_MIN_POOL_SIZE,
+        connectTimeoutMS=Settings.MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=Settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        socketTimeoutMS=Settings.MONGO_SOCKET_TIMEOUT_MS,
+        waitQueueTimeoutMS=Settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        event_listeners=[pool_metrics]
+    )
+
+
+def get_client():
+    """
+    Возвращает общий для процесса клиент MongoDB
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = create_client()
+    return _client
+
+
+def set_client(client):
+    """
+    Подменяет общий клиент, например на хранилище в памяти для тестов.
+    Вызывается до импорта модулей, работающих с коллекциями
+    :param client: клиент MongoDB
+    """
+    global _client
+    with _lock:
+        _client = client
+
+
+def get_database():
+    return get_client()[Settings.MONGO_DB_NAME]
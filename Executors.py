@@ -0,0 +1,283 @@
+import asyncio
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+import Settings
+
+
+def init_cpu_worker():
+    """
+    Инициализатор процесса пула: загружает NLP-модели и сохраненный кэш лемм один раз на процесс
+    """
+    import NlpModels
+    NlpModels.lemma_cache.load()
+    NlpModels.registry.warm_up()
+
+
+def warm_up_task():
+    return True
+
+
+def extract_text_task(file_name, path):
+    """
+    Извлекает текст из сохраненного файла
+    :param file_name: имя файла
+    :param path: путь к файлу
+    :return: очищенный текст
+    """
+    import ReadFile
+    content = ReadFile.extract_file_text(file_name, path)
+    return ReadFile.clean_text(content) if content else ""
+
+
+def pdf_page_count_task(path):
+    import ReadFile
+    with ReadFile.open_mapped(path) as f:
+        return ReadFile.pdf_page_count(f)
+
+
+def extract_pdf_pages_task(path, start, stop):
+    """
+    Извлекает текст диапазона страниц PDF-файла
+    :param path: путь к PDF-файлу
+    :param start: номер первой страницы
+    :param stop: номер страницы, на которой нужно остановиться
+    :return: массив очищенного текста непустых страниц
+    """
+    import ReadFile
+    with ReadFile.open_mapped(path) as f:
+        return list(ReadFile.iter_pdf_pages(f, start, stop))
+
+
+def xlsx_sheet_names_task(path):
+    import ReadFile
+    with ReadFile.open_mapped(path) as f:
+        return ReadFile.xlsx_sheet_names(f)
+
+
+def extract_xlsx_sheet_task(path, sheet_name):
+    """
+    Извлекает текст одного листа книги Excel
+    :param path: путь к xlsx-файлу
+    :param sheet_name: название листа
+    :return: очищенный текст листа
+    """
+    import ReadFile
+    with ReadFile.open_mapped(path) as f:
+        return ReadFile.read_xlsx_text(f, [sheet_name])
+
+
+def analyze_paragraphs_task(paragraphs, vocabulary):
+    """
+    Находит фразы словаря тегов во фрагментах текста
+    :param paragraphs: массив фрагментов текста
+    :param vocabulary: массив фраз словаря тегов
+    :return: результаты анализа фрагментов
+    """
+    from CreateTags import TagGenerate
+    return TagGenerate().analyze_paragraphs(paragraphs, vocabulary)
+
+
+def extract_terms_task(texts):
+    """
+    Разбивает тексты документов на термины полнотекстового индекса
+    :param texts: массив текстов документов
+    :return: массив словарей, где ключ - термин, значение - количество вхождений
+    """
+    import TextIndex
+    return [TextIndex.extract_terms(text or "") for text in texts]
+
+
+class ExecutorPools:
+    """
+    Пулы исполнителей: процессы для разбора файлов и генерации тегов, потоки для ввода-вывода.
+    Ограничивают количество ожидающих задач и время выполнения каждой задачи
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cpu_pool = None
+        self._io_pool = None
+        self._pending = {"cpu": 0, "io": 0}
+        self._rejected = {"cpu": 0, "io": 0}
+        self._timed_out = {"cpu": 0, "io": 0}
+        self._fanout = None
+
+
+    def start(self):
+        """
+        Создает пулы и заранее запускает процессы с загруженными моделями
+        """
+        with self._lock:
+            if self._io_pool is None:
+                self._io_pool = ThreadPoolExecutor(max_workers=Settings.IO_WORKERS, thread_name_prefix="io")
+            if self._cpu_pool is None:
+                if Settings.USE_PROCESS_POOL:
+                    self._cpu_pool = ProcessPoolExecutor(
+                        max_workers=Settings.CPU_WORKERS,
+                        mp_context=multiprocessing.get_context(Settings.PROCESS_START_METHOD),
+                        initializer=init_cpu_worker
+                    )
+                    for _ in range(Settings.CPU_WORKERS):
+                        self._cpu_pool.submit(warm_up_task)
+                else:
+                    self._cpu_pool = ThreadPoolExecutor(max_workers=Settings.CPU_WORKERS, thread_name_prefix="cpu")
+
+
+    def shutdown(self):
+        with self._lock:
+            for pool in (self._cpu_pool, self._io_pool):
+                if pool is not None:
+                    pool.shutdown(wait=False, cancel_futures=True)
+            self._cpu_pool = None
+            self._io_pool = None
+
+
+    def restart_cpu(self):
+        """
+        Перезапускает пул процессов, чтобы новые процессы загрузили текущие модели и кэш лемм.
+        Уже отправленные в старый пул задачи выполняются до конца
+        """
+        with self._lock:
+            pool = self._cpu_pool
+            self._cpu_pool = None
+        if pool is not None:
+            pool.shutdown(wait=False)
+        self.start()
+
+
+    async def _run(self, kind, fn, *args, timeout=None):
+        if self._cpu_pool is None or self._io_pool is None:
+            self.start()
+        pool = self._cpu_pool if kind == "cpu" else self._io_pool
+
+        with self._lock:
+            if self._pending[kind] >= Settings.EXECUTOR_MAX_QUEUE:
+                self._rejected[kind] += 1
+                raise HTTPException(status_code=503, detail="Сервер перегружен, повторите запрос позже")
+            self._pending[kind] += 1
+
+        try:
+            future = pool.submit(fn, *args)
+        except BaseException:
+            self._release(kind)
+            raise
+        # Задача занимает место в очереди, пока пул ее не выполнит: по таймауту отменяется только ожидание
+        future.add_done_callback(lambda _: self._release(kind))
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or Settings.TASK_TIMEOUT)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._timed_out[kind] += 1
+            raise HTTPException(status_code=504, detail="Превышено время обработки запроса")
+
+
+    def _release(self, kind):
+        with self._lock:
+            self._pending[kind] -= 1
+
+
+    async def run_cpu(self, fn, *args, timeout=None):
+        """
+        Выполняет ресурсоемкую задачу в пуле процессов
+        :param fn: функция уровня модуля
+        :param args: аргументы функции
+        :param timeout: ограничение времени выполнения в секундах
+        :return: результат функции
+        """
+        return await self._run("cpu", fn, *args, timeout=timeout)
+
+
+    async def run_io(self, fn, *args, timeout=None):
+        """
+        Выполняет блокирующую операцию ввода-вывода в пуле потоков
+        :param fn: функция
+        :param args: аргументы функции
+        :param timeout: ограничение времени выполнения в секундах
+        :return: результат функции
+        """
+        return await self._run("io", fn, *args, timeout=timeout)
+
+
+    async def imap_cpu(self, fn, args_list, window=None):
+        """
+        Выполняет задачи в пуле процессов, держа в работе не более window задач одновременно
+        :param fn: функция уровня модуля
+        :param args_list: последовательность кортежей аргументов
+        :param window: максимальное количество одновременно выполняемых задач
+        :return: асинхронный генератор результатов в порядке аргументов
+        """
+        window = window or Settings.PDF_INFLIGHT_WINDOW
+        if self._fanout is None:
+            self._fanout = asyncio.Semaphore(Settings.CPU_FANOUT_LIMIT)
+        in_flight = deque()
+        try:
+            for args in args_list:
+                in_flight.append(asyncio.ensure_future(self._run_fanout(fn, args)))
+                if len(in_flight) >= window:
+                    yield await in_flight.popleft()
+            while in_flight:
+                yield await in_flight.popleft()
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+
+    async def _run_fanout(self, fn, args):
+        # Общий для всех запросов семафор не дает частям разных файлов заполнить очередь пула
+        async with self._fanout:
+            return await self.run_cpu(fn, *args)
+
+
+    def stats(self):
+        with self._lock:
+            return {
+                "use_process_pool": Settings.USE_PROCESS_POOL,
+                "cpu_workers": Settings.CPU_WORKERS,
+                "io_workers": Settings.IO_WORKERS,
+                "max_queue": Settings.EXECUTOR_MAX_QUEUE,
+                "task_timeout": Settings.TASK_TIMEOUT,
+                "pending": dict(self._pending),
+                "rejected": dict(self._rejected),
+                "timed_out": dict(self._timed_out)
+            }
+
+
+pools = ExecutorPools()
+
+
+async def iter_pdf_pages(path):
+    """
+    Извлекает текст страниц PDF-файла. Большие файлы делятся на диапазоны страниц,
+    которые параллельно обрабатываются в пуле процессов
+    :param path: путь к PDF-файлу
+    :return: асинхронный генератор очищенного текста страниц в порядке следования
+    """
+    page_count = await pools.run_cpu(pdf_page_count_task, path)
+    if page_count < Settings.PDF_PARALLEL_MIN_PAGES:
+        ranges = [(path, 0, page_count)]
+    else:
+        ranges = [
+            (path, start, min(start + Settings.PDF_PAGES_PER_TASK, page_count))
+            for start in range(0, page_count, Settings.PDF_PAGES_PER_TASK)
+        ]
+    async for pages in pools.imap_cpu(extract_pdf_pages_task, ranges):
+        for page in pages:
+            yield page
+
+
+async def iter_xlsx_sheets(path):
+    """
+    Извлекает текст листов книги Excel, параллельно обрабатывая листы в пуле процессов
+    :param path: путь к xlsx-файлу
+    :return: асинхронный генератор очищенного текста листов в порядке следования
+    """
+    sheet_names = await pools.run_cpu(xlsx_sheet_names_task, path)
+    async for text in pools.imap_cpu(extract_xlsx_sheet_task, [(path, name) for name in sheet_names]):
+        if text:
+            yield text
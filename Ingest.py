@@ -0,0 +1,316 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import ReadFile
+import Settings
+
+STOP = object()
+
+
+class Stage:
+    """
+    Стадия конвейера загрузки: несколько потоков читают элементы из входной очереди,
+    обрабатывают их по одному или пакетами и передают результаты в выходную очередь.
+    Ошибка обработки передается в on_error и не останавливает стадию: если упал пакет,
+    его элементы обрабатываются по одному
+    """
+
+    def __init__(self, name, fn, inbox, outbox=None, workers=1, batch_size=1, on_error=None):
+        self.name = name
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+        self.workers = workers
+        self.batch_size = batch_size
+        self.on_error = on_error
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+        self._active = workers
+        self._threads = []
+
+
+    def _take_batch(self):
+        item = self.inbox.get()
+        if item is STOP:
+            return None
+        batch = [item]
+        while len(batch) < self.batch_size:
+            try:
+                item = self.inbox.get(timeout=0.5)
+            except queue.Empty:
+                break
+            if item is STOP:
+                self.inbox.put(STOP)
+                break
+            batch.append(item)
+        return batch
+
+
+    def _fail(self, item, error):
+        with self._lock:
+            self.failed += 1
+        try:
+            if self.on_error is not None:
+                self.on_error(item, error)
+            else:
+                print(f"{self.name}: ошибка обработки {item}: {error}")
+        except Exception as e:
+            print(f"{self.name}: не удалось записать ошибку обработки: {e}")
+
+
+    def _process(self, batch):
+        try:
+            return list(self.fn(batch if self.batch_size > 1 else batch[0]))
+        except Exception as e:
+            if len(batch) == 1:
+                self._fail(batch[0], e)
+                return []
+        results = []
+        for item in batch:
+            try:
+                results.extend(self.fn([item]))
+            except Exception as e:
+                self._fail(item, e)
+        return results
+
+
+    def _run(self):
+        try:
+            while True:
+                batch = self._take_batch()
+                if batch is None:
+                    self.inbox.put(STOP)
+                    break
+                started = time.perf_counter()
+                results = self._process(batch)
+                with self._lock:
+                    self.busy += time.perf_counter() - started
+                    self.processed += len(batch)
+                if self.outbox is not None:
+                    for result in results:
+                        self.outbox.put(result)
+        finally:
+            with self._lock:
+                self._active -= 1
+                last = self._active == 0
+            if last:
+                self.finished = time.perf_counter()
+                if self.outbox is not None:
+                    self.outbox.put(STOP)
+
+
+    def start(self):
+        self.started = time.perf_counter()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+
+    def report(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        return (f"{self.name:<10} файлов: {self.processed:<6} ошибок: {self.failed:<5} время: {elapsed:8.2f} с  "
+                f"в работе: {self.busy:8.2f} с  скорость: {rate:8.2f} файл/с")
+
+
+class IngestState:
+    """
+    Журнал обработанных файлов. Позволяет продолжить загрузку после прерывания:
+    загруженные файлы и дубликаты пропускаются, файлы с ошибками обрабатываются заново
+    """
+
+    FINAL_STATUSES = ("success", "duplicate")
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done_hashes = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        entry = json.loads(line)
+                        if entry["status"] in self.FINAL_STATUSES:
+                            self.done_hashes.add(entry["file_hash"])
+
+
+    def record(self, path, file_hash, status, document_id=None, detail=None):
+        entry = {"path": path, "file_hash": file_hash, "status": status,
+                 "document_id": str(document_id) if document_id else None, "detail": detail}
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            if status in self.FINAL_STATUSES:
+                self.done_hashes.add(file_hash)
+
+
+def find_files(directory):
+    """
+    Находит файлы поддерживаемых форматов в каталоге и его подкаталогах
+    :param directory: каталог
+    :return: генератор путей к файлам
+    """
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            if any(name.endswith(extension) for extension in ReadFile.EXTRACTORS):
+                yield os.path.join(root, name)
+
+
+def ingest(directory, user="admin", tags=None, state_path=None, extract_workers=Settings.CPU_WORKERS,
+           queue_size=32, batch_size=16):
+    """
+    Загружает документы из каталога в базу данных конвейером
+    поиск хэша -> извлечение текста -> очистка -> генерация тегов -> проверка дубликатов и запись
+    :param directory: каталог с документами
+    :param user: пользователь, от имени которого загружаются документы
+    :param tags: теги, добавляемые ко всем документам
+    :param state_path: путь к журналу обработанных файлов
+    :param extract_workers: количество процессов извлечения текста
+    :param queue_size: размер очередей между стадиями
+    :param batch_size: размер пакета генерации тегов и записи в базу данных
+    :return: массив стадий со статистикой
+    """
+    import Migrations
+    import mongoDB
+    from CreateTags import TagGenerate
+
+    mongoDB.ensure_indexes()
+    os.makedirs(Settings.UPLOAD_DIRECTORY, exist_ok=True)
+    state = IngestState(state_path or os.path.join(directory, ".ingest_state.jsonl"))
+    tag_service = TagGenerate()
+    vocabulary = mongoDB.TagStructure().get_tag_vocabulary()
+    extra_tags = [tag.strip() for tag in tags or [] if tag.strip()]
+    pool = ProcessPoolExecutor(max_workers=extract_workers,
+                               mp_context=multiprocessing.get_context(Settings.PROCESS_START_METHOD))
+
+    def hash_file(path):
+        file_hash = Migrations.file_sha256(path)
+        if file_hash in state.done_hashes:
+            return []
+        if mongoDB.docs_collection.find_one({"file_hash": file_hash}, {"_id": 1}):
+            state.record(path, file_hash, "duplicate", detail="Документ уже существует в базе данных")
+            return []
+        return [{"path": path, "file_hash": file_hash}]
+
+    def extract(item):
+        try:
+            item["content"] = pool.submit(ReadFile.extract_file_text, Path(item["path"]).name, item["path"]).result()
+        except Exception as e:
+            state.record(item["path"], item["file_hash"], "error", detail=str(e))
+            return []
+        return [item]
+
+    def clean(item):
+        item["content"] = ReadFile.clean_text(item["content"]) if item["content"] else ""
+        if not item["content"]:
+            state.record(item["path"], item["file_hash"], "error", detail="Не удалось извлечь текст")
+            return []
+        return [item]
+
+    def generate_tags(items):
+        keywords = tag_service.extract_keywords_batch([item["content"] for item in items], vocabulary=vocabulary)
+        for item, auto_tags in zip(items, keywords):
+            item_tags = list(extra_tags)
+            item_tags.extend(tag for tag in auto_tags if tag not in item_tags)
+            if not item_tags:
+                item_tags.append(Path(item["path"]).stem.lower())
+            item["tags"] = item_tags
+        return items
+
+    def store(items):
+        documents = [{
+            "title": Path(item["path"]).name,
+            "content": item["content"],
+            "file_path": os.path.join(Settings.UPLOAD_DIRECTORY, Path(item["path"]).name),
+            "file_hash": item["file_hash"],
+            "tags": item["tags"]
+        } for item in items]
+        # Как и API, храним копию файла в каталоге загрузок. Дубликаты отсеиваются до копирования,
+        # чтобы не затереть файл уже сохраненного документа с тем же именем
+        duplicates, _ = mongoDB.find_batch_duplicates(mongoDB.docs_collection, documents)
+        new_items = []
+        new_documents = []
+        for item, document, is_duplicate in zip(items, documents, duplicates):
+            if is_duplicate:
+                state.record(item["path"], item["file_hash"], "duplicate",
+                             detail="Документ уже существует в базе данных")
+                continue
+            shutil.copy2(item["path"], document["file_path"])
+            new_items.append(item)
+            new_documents.append(document)
+
+        results = mongoDB.upload_documents_to_db(new_documents, user)
+        for item, (doc_id, error) in zip(new_items, results):
+            if doc_id is None:
+                state.record(item["path"], item["file_hash"], "duplicate", detail=error)
+            else:
+                state.record(item["path"], item["file_hash"], "error" if error else "success", doc_id, error)
+        return []
+
+    def record_error(item, error):
+        if isinstance(item, str):
+            state.record(item, None, "error", detail=str(error))
+        else:
+            state.record(item["path"], item["file_hash"], "error", detail=str(error))
+
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(5)]
+    stages = [
+        Stage("hash", hash_file, queues[0], queues[1], workers=2, on_error=record_error),
+        Stage("extract", extract, queues[1], queues[2], workers=extract_workers, on_error=record_error),
+        Stage("clean", clean, queues[2], queues[3], on_error=record_error),
+        Stage("tags", generate_tags, queues[3], queues[4], batch_size=batch_size, on_error=record_error),
+        Stage("store", store, queues[4], batch_size=batch_size, on_error=record_error),
+    ]
+
+    try:
+        for stage in stages:
+            stage.start()
+        for path in find_files(directory):
+            queues[0].put(path)
+        queues[0].put(STOP)
+        for stage in stages:
+            stage.join()
+    finally:
+        pool.shutdown()
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная загрузка документов из каталога в базу данных")
+    parser.add_argument("directory", help="каталог с файлами .pdf, .docx, .xlsx")
+    parser.add_argument("--user", default="admin", help="пользователь, от имени которого загружаются документы")
+    parser.add_argument("--tags", nargs="*", default=[], help="теги, добавляемые ко всем документам")
+    parser.add_argument("--state", default=None, help="журнал обработанных файлов для продолжения загрузки")
+    parser.add_argument("--workers", type=int, default=Settings.CPU_WORKERS, help="процессы извлечения текста")
+    parser.add_argument("--queue-size", type=int, default=32, help="размер очередей между стадиями")
+    parser.add_argument("--batch-size", type=int, default=16, help="размер пакета генерации тегов и записи")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    stages = ingest(args.directory, args.user, args.tags, args.state, args.workers, args.queue_size, args.batch_size)
+    for stage in stages:
+        print(stage.report())
+    print(f"Всего: {time.perf_counter() - started:.2f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import asyncio
+import os
+import socket
+import traceback
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import ASCENDING, ReturnDocument
+
+import Database
+import Executors
+import Settings
+
+db = Database.get_database()
+jobs_collection = db['jobs']
+
+
+class JobQueue:
+    """
+    Очередь фоновых задач в коллекции MongoDB. Задачи забираются атомарно через find_one_and_update
+    и удерживаются на время аренды: задачу упавшего процесса после окончания аренды заберет другой
+    обработчик. Неудачные попытки повторяются с увеличивающейся задержкой
+    """
+
+    def __init__(self, collection, workers=Settings.JOB_WORKERS):
+        self.collection = collection
+        self.workers = workers
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._handlers = {}
+        self._cleanups = {}
+        self._tasks = []
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+
+    def ensure_indexes(self):
+        self.collection.create_index([("status", ASCENDING), ("available_at", ASCENDING)])
+        self.collection.create_index(
+            "finished_at", expireAfterSeconds=Settings.JOB_RESULT_TTL_DAYS * 24 * 3600
+        )
+
+
+    def register(self, kind, handler, cleanup=None):
+        """
+        Регистрирует обработчик задач
+        :param kind: тип задачи
+        :param handler: асинхронная функция handler(job_id, params), возвращающая результат задачи
+        :param cleanup: функция cleanup(params), освобождающая ресурсы задачи после окончательной неудачи
+        """
+        self._handlers[kind] = handler
+        if cleanup is not None:
+            self._cleanups[kind] = cleanup
+
+
+    def _cleanup(self, job):
+        cleanup = self._cleanups.get(job["kind"])
+        if cleanup is None:
+            return
+        try:
+            cleanup(job["params"])
+        except Exception as e:
+            print(f"Ошибка освобождения ресурсов задачи {job['_id']}: {e}")
+
+
+    def submit(self, kind, params):
+        """
+        Ставит задачу в очередь
+        :param kind: тип задачи
+        :param params: параметры задачи
+        :return: ID задачи
+        """
+        now = datetime.utcnow()
+        return self.collection.insert_one({
+            "kind": kind,
+            "params": params,
+            "status": "queued",
+            "progress": "queued",
+            "attempts": 0,
+            "max_attempts": Settings.JOB_MAX_ATTEMPTS,
+            "available_at": now,
+            "lease_until": None,
+            "worker": None,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "finished_at": None
+        }).inserted_id
+
+
+    def expire_abandoned(self):
+        """
+        Отмечает неудачными задачи, обработчик которых остановился на последней попытке:
+        аренда истекла, а повторять задачу уже нельзя
+        :return: количество отмеченных задач
+        """
+        now = datetime.utcnow()
+        query = {"status": "running", "lease_until": {"$lt": now},
+                 "$expr": {"$gte": ["$attempts", "$max_attempts"]}}
+        expired = 0
+        for job in self.collection.find(query, {"kind": 1, "params": 1}):
+            result = self.collection.update_one(
+                {"_id": job["_id"], **query},
+                {"$set": {"status": "failed", "progress": "failed", "lease_until": None,
+                          "error": "Обработчик задачи остановился, попытки исчерпаны",
+                          "updated_at": now, "finished_at": now}}
+            )
+            if result.modified_count:
+                expired += 1
+                self._cleanup(job)
+        self.failed += expired
+        return expired
+
+
+    def claim(self):
+        """
+        Забирает следующую готовую задачу: в очереди или с истекшей арендой
+        :return: задача или None
+        """
+        self.expire_abandoned()
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {
+                "kind": {"$in": list(self._handlers.keys())},
+                "$or": [
+                    {"status": "queued", "available_at": {"$lte": now}},
+                    {"status": "running", "lease_until": {"$lt": now},
+                     "$expr": {"$lt": ["$attempts", "$max_attempts"]}}
+                ]
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "lease_until": now + timedelta(seconds=Settings.JOB_LEASE_SECONDS),
+                    "worker": self.worker_id,
+                    "updated_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("available_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+
+    def set_progress(self, job_id, progress):
+        self.collection.update_one(
+            {"_id": job_id, "worker": self.worker_id},
+            {"$set": {"progress": progress, "updated_at": datetime.utcnow()}}
+        )
+
+
+    def finish(self, job_id, result):
+        now = datetime.utcnow()
+        self.collection.update_one(
+            {"_id": job_id, "worker": self.worker_id},
+            {"$set": {"status": "done", "progress": "done", "result": result,
+                      "error": None, "updated_at": now, "finished_at": now}}
+        )
+
+
+    def fail(self, job, error, retry):
+        """
+        Отмечает неудачную попытку. Задача возвращается в очередь, пока не исчерпаны попытки
+        :param job: задача
+        :param error: описание ошибки
+        :param retry: можно ли повторить задачу
+        """
+        now = datetime.utcnow()
+        if retry and job["attempts"] < job["max_attempts"]:
+            delay = Settings.JOB_RETRY_DELAY * 2 ** (job["attempts"] - 1)
+            update = {"status": "queued", "progress": "retry", "error": error, "lease_until": None,
+                      "available_at": now + timedelta(seconds=delay), "updated_at": now}
+            self.retried += 1
+        else:
+            update = {"status": "failed", "progress": "failed", "error": error,
+                      "updated_at": now, "finished_at": now}
+            self.failed += 1
+        self.collection.update_one({"_id": job["_id"], "worker": self.worker_id}, {"$set": update})
+        if update["status"] == "failed":
+            self._cleanup(job)
+
+
+    def extend_lease(self, job_id):
+        self.collection.update_one(
+            {"_id": job_id, "worker": self.worker_id, "status": "running"},
+            {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=Settings.JOB_LEASE_SECONDS)}}
+        )
+
+
+    async def _heartbeat(self, job_id):
+        while True:
+            await asyncio.sleep(Settings.JOB_LEASE_SECONDS / 3)
+            await Executors.pools.run_io(self.extend_lease, job_id)
+
+
+    async def process(self, job):
+        handler = self._handlers[job["kind"]]
+        heartbeat = asyncio.ensure_future(self._heartbeat(job["_id"]))
+        try:
+            result = await handler(job["_id"], job["params"])
+        except HTTPException as e:
+            # Ошибки запроса (дубликат, нет тегов) при повторе не исчезнут
+            await Executors.pools.run_io(self.fail, job, e.detail, e.status_code >= 500)
+        except Exception as e:
+            traceback.print_exc()
+            await Executors.pools.run_io(self.fail, job, str(e), True)
+        else:
+            await Executors.pools.run_io(self.finish, job["_id"], result)
+            self.completed += 1
+        finally:
+            heartbeat.cancel()
+
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await Executors.pools.run_io(self.claim)
+            except Exception as e:
+                print(f"Ошибка получения задачи: {e}")
+                job = None
+            if job is None:
+                await asyncio.sleep(Settings.JOB_POLL_INTERVAL)
+                continue
+            await self.process(job)
+
+
+    def start(self):
+        """
+        Запускает обработчики задач в текущем цикле событий. Количество обработчиков ограничивает
+        число одновременно выполняемых задач в процессе
+        """
+        if not self._tasks:
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+    def get(self, job_id):
+        try:
+            return self.collection.find_one({"_id": ObjectId(job_id)})
+        except Exception:
+            return None
+
+
+    def stats(self):
+        counts = {
+            item["_id"]: item["count"]
+            for item in self.collection.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}])
+        }
+        return {
+            "workers": self.workers,
+            "active_workers": len(self._tasks),
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "jobs_by_status": counts
+        }
+
+
+job_queue = JobQueue(jobs_collection)
@@ -0,0 +1,99 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class LemmaCache:
+    """
+    Ограниченный LRU-кэш нормальных форм слов, общий для генерации тегов и поиска
+    """
+
+    def __init__(self, max_size, path=None):
+        self.max_size = max_size
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, word, compute):
+        """
+        Возвращает нормальную форму слова из кэша или вычисляет ее
+        :param word: исходное слово
+        :param compute: функция вычисления нормальной формы
+        :return: нормальная форма слова
+        """
+        with self._lock:
+            if word in self._data:
+                self._data.move_to_end(word)
+                self.hits += 1
+                return self._data[word]
+            self.misses += 1
+
+        value = compute(word)
+
+        with self._lock:
+            self._data[word] = value
+            self._data.move_to_end(word)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+        return value
+
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+    def stats(self):
+        """
+        Возвращает размер кэша и счетчики попаданий
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0
+            }
+
+
+    def save(self):
+        """
+        Сохраняет содержимое кэша на диск, если задан путь
+        """
+        if not self.path:
+            return
+        with self._lock:
+            items = list(self._data.items())
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(items, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+    def load(self):
+        """
+        Загружает сохраненный кэш с диска, чтобы перезапущенный воркер стартовал прогретым
+        :return: количество загруженных слов
+        """
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                items = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Не удалось загрузить кэш лемм: {str(e)}")
+            return 0
+        with self._lock:
+            for word, value in items[-self.max_size:]:
+                self._data[word] = value
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+            return len(self._data)
@@ -0,0 +1,138 @@
+import hashlib
+import os
+
+from pymongo import UpdateOne
+
+import MinHash
+import Moderation
+import Settings
+import mongoDB
+
+
+def file_sha256(path):
+    """
+    Считает SHA-256 файла, читая его блоками
+    :param path: путь к файлу
+    :return: шестнадцатеричная строка или None, если файл не найден
+    """
+    if not path or not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(Settings.UPLOAD_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def backfill_hashes(collection, batch_size=500):
+    """
+    Заполняет поля content_hash и file_hash у документов, загруженных до их появления
+    :param collection: коллекция документов
+    :param batch_size: количество обновлений в одном запросе
+    :return: количество обновленных документов
+    """
+    updated = 0
+    operations = []
+    query = {"$or": [{"content_hash": {"$exists": False}}, {"file_hash": {"$exists": False}}]}
+    for doc in collection.find(query, {"content": 1, "file_path": 1, "content_hash": 1, "file_hash": 1}):
+        fields = {}
+        if "content_hash" not in doc:
+            fields["content_hash"] = mongoDB.content_hash(doc.get("content") or "")
+        if "file_hash" not in doc:
+            fields["file_hash"] = file_sha256(doc.get("file_path"))
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields}))
+        if len(operations) >= batch_size:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    return updated
+
+
+def backfill_minhash(collection, batch_size=500):
+    """
+    Вычисляет MinHash-сигнатуры и полосы LSH у документов, загруженных до их появления
+    :param collection: коллекция документов
+    :param batch_size: количество обновлений в одном запросе
+    :return: количество обновленных документов
+    """
+    updated = 0
+    operations = []
+    for doc in collection.find({"lsh_bands": {"$exists": False}}, {"content": 1}):
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": MinHash.document_fields(doc.get("content") or "")}))
+        if len(operations) >= batch_size:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    return updated
+
+
+def migrate_tag_postings(batch_size=1000):
+    """
+    Переносит массивы documents из документов коллекции tags в коллекцию tag_postings
+    :param batch_size: количество записей в одном запросе
+    :return: количество перенесенных связей
+    """
+    migrated = 0
+    for tag in mongoDB.tags_collection.find({"documents": {"$exists": True}}, {"name": 1, "documents": 1}):
+        operations = []
+        for ref in tag.get("documents") or []:
+            operations.append(UpdateOne(
+                {"tag": tag["name"].lower(), "doc_id": ref["_id"]},
+                {"$set": {"file_path": ref.get("file_path")}},
+                upsert=True
+            ))
+            if len(operations) >= batch_size:
+                mongoDB.postings_collection.bulk_write(operations, ordered=False)
+                migrated += len(operations)
+                operations = []
+        if operations:
+            mongoDB.postings_collection.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+        mongoDB.tags_collection.update_one({"_id": tag["_id"]}, {"$unset": {"documents": ""}})
+    return migrated
+
+
+def find_conflicts(collection):
+    """
+    Находит документы, мешающие созданию уникальных индексов
+    :param collection: коллекция документов
+    :return: словарь, где ключ - поле, значение - массив групп ID документов с одинаковым значением
+    """
+    conflicts = {}
+    for field in ("title", "file_path", "content_hash", "file_hash"):
+        groups = collection.aggregate([
+            {"$match": {field: {"$type": "string"}}},
+            {"$group": {"_id": f"${field}", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}
+        ])
+        conflicts[field] = [[str(doc_id) for doc_id in group["ids"]] for group in groups]
+    return conflicts
+
+
+def run():
+    for collection in (mongoDB.docs_collection, Moderation.moderation_collection):
+        updated = backfill_hashes(collection)
+        print(f"{collection.name}: заполнены хэши у {updated} документов")
+        updated = backfill_minhash(collection)
+        print(f"{collection.name}: вычислены MinHash-сигнатуры у {updated} документов")
+        for field, groups in find_conflicts(collection).items():
+            for ids in groups:
+                print(f"{collection.name}: одинаковое поле {field} у документов {', '.join(ids)}")
+
+    removed = mongoDB.docs_collection.update_many(
+        {"paragraph_hashes": {"$exists": True}}, {"$unset": {"paragraph_hashes": ""}}
+    ).modified_count
+    print(f"{mongoDB.docs_collection.name}: удалено неиспользуемое поле paragraph_hashes у {removed} документов")
+
+    try:
+        mongoDB.ensure_indexes()
+        Moderation.ensure_indexes()
+    except RuntimeError as e:
+        print(e)
+    print(f"tag_postings: перенесено {migrate_tag_postings()} связей документов и тегов")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,105 @@
+import hashlib
+import zlib
+
+import numpy as np
+
+import ReadFile
+import Settings
+
+MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+MAX_HASH = (1 << 31) - 1
+SHINGLE_CHUNK = 10000
+
+_generator = np.random.RandomState(Settings.MINHASH_SEED)
+_a = _generator.randint(1, MAX_HASH, size=Settings.MINHASH_NUM_PERM).astype(np.uint64)
+_b = _generator.randint(0, MAX_HASH, size=Settings.MINHASH_NUM_PERM).astype(np.uint64)
+
+
+def shingles(text, size=Settings.SHINGLE_SIZE):
+    """
+    Разбивает очищенный текст на перекрывающиеся последовательности слов
+    :param text: текст документа
+    :param size: количество слов в последовательности
+    :return: множество последовательностей слов
+    """
+    words = ReadFile.clean_text(text).lower().split()
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def signature(text):
+    """
+    Вычисляет MinHash-сигнатуру текста
+    :param text: текст документа
+    :return: массив numpy из MINHASH_NUM_PERM минимальных хэшей
+    """
+    values = np.fromiter(
+        (zlib.crc32(shingle.encode("utf-8")) & MAX_HASH for shingle in shingles(text)), dtype=np.uint64
+    )
+    result = np.full(Settings.MINHASH_NUM_PERM, MAX_HASH, dtype=np.uint64)
+    for start in range(0, len(values), SHINGLE_CHUNK):
+        chunk = values[start:start + SHINGLE_CHUNK]
+        hashes = (_a[:, None] * chunk[None, :] + _b[:, None]) % MERSENNE_PRIME
+        result = np.minimum(result, hashes.min(axis=1))
+    return result
+
+
+def bands(sig, band_count=Settings.MINHASH_BANDS):
+    """
+    Делит сигнатуру на полосы LSH. Документы с совпадающей полосой становятся кандидатами в похожие
+    :param sig: MinHash-сигнатура
+    :param band_count: количество полос
+    :return: массив ключей полос
+    """
+    rows = len(sig) // band_count
+    keys = []
+    for i in range(band_count):
+        band = np.ascontiguousarray(sig[i * rows:(i + 1) * rows])
+        keys.append(f"{i}:{hashlib.blake2b(band.tobytes(), digest_size=8).hexdigest()}")
+    return keys
+
+
+def document_fields(text):
+    """
+    Возвращает поля документа для поиска похожих документов
+    :param text: текст документа
+    :return: словарь с сигнатурой minhash и ключами полос lsh_bands
+    """
+    sig = signature(text)
+    if (sig == MAX_HASH).all():
+        return {"minhash": [], "lsh_bands": []}
+    return {"minhash": sig.tolist(), "lsh_bands": bands(sig)}
+
+
+def similarity(sig, other):
+    """
+    Оценивает коэффициент Жаккара двух документов по их сигнатурам
+    :return: доля совпадающих минимальных хэшей
+    """
+    return float(np.mean(np.asarray(sig, dtype=np.uint64) == np.asarray(other, dtype=np.uint64)))
+
+
+def find_similar(collection, fields, threshold=Settings.NEAR_DUPLICATE_THRESHOLD, exclude_id=None, limit=10):
+    """
+    Находит похожие документы через индекс полос LSH, не просматривая всю коллекцию
+    :param collection: коллекция документов
+    :param fields: поля minhash и lsh_bands искомого документа
+    :param threshold: минимальная оценка сходства
+    :param exclude_id: ID документа, который не включается в результат
+    :param limit: максимальное количество документов
+    :return: массив словарей с полями document_id, title, similarity по убыванию сходства
+    """
+    if not fields.get("lsh_bands"):
+        return []
+    query = {"lsh_bands": {"$in": fields["lsh_bands"]}}
+    if exclude_id is not None:
+        query["_id"] = {"$ne": exclude_id}
+
+    similar = []
+    for doc in collection.find(query, {"minhash": 1, "title": 1}):
+        score = similarity(fields["minhash"], doc["minhash"])
+        if score >= threshold:
+            similar.append({"document_id": str(doc["_id"]), "title": doc.get("title"), "similarity": round(score, 3)})
+    similar.sort(key=lambda x: x["similarity"], reverse=True)
+    return similar[:limit]
@@ -1,21 +1,25 @@
-from pymongo import MongoClient
 from datetime import datetime
 import pytz
+from pymongo.errors import DuplicateKeyError
 
+import Database
+import MinHash
 import mongoDB
 
-client = MongoClient("mongodb://localhost:27017/")
-db = client['database']
+db = Database.get_database()
 moderation_collection = db["moderation_documents"]
 
-def upload_document_to_moderation(title, content, file_path, user, tags=None):
-    duplicate = moderation_collection.find_one({
-        "$or": [
-            {"title": title},
-            {"file_path": file_path},
-            {"content": content}
-        ]
-    })
+
+def ensure_indexes():
+    mongoDB.ensure_document_indexes(moderation_collection)
+
+
+def upload_document_to_moderation(title, content, file_path, user, tags=None, file_hash=None, job_id=None,
+                                  minhash_fields=None):
+    text_hash = mongoDB.content_hash(content)
+    duplicate = moderation_collection.find_one(
+        mongoDB.duplicate_filter(title, file_path, text_hash, file_hash), {"_id": 1}
+    )
 
     if duplicate:
         print(f"Документ уже существует в базе данных: {title}")
@@ -33,14 +37,62 @@ def upload_document_to_moderation(title, content, file_path, user, tags=None):
         "file_path": file_path,
         "user": user,
         "tags": lower_tags,
+        **(minhash_fields or MinHash.document_fields(content)),
+        "content_hash": text_hash,
+        "file_hash": file_hash,
         "status": "pending",  # pending, approved, rejected
         "created_at": formatted_time,
         "moderated_at": None,
         "moderator": None,
         "final_tags": None
     }
+    if job_id is not None:
+        document["job_id"] = job_id
+
+    try:
+        return moderation_collection.insert_one(document).inserted_id
+    except DuplicateKeyError:
+        print(f"Документ уже существует в базе данных: {title}")
+        return None
+
+
+def upload_documents_to_moderation(documents, user):
+    """
+    Пакетно отправляет документы на модерацию
+    :param documents: массив словарей с полями title, content, file_path, tags и, необязательно, file_hash
+    :param user: пользователь, загрузивший документы
+    :return: массив ID документов в порядке входных документов, None для дубликатов
+    """
+    duplicates, text_hashes = mongoDB.find_batch_duplicates(moderation_collection, documents)
+
+    moscow_tz = pytz.timezone('Europe/Moscow')
+    current_time_msk = datetime.now(moscow_tz)
+    formatted_time = current_time_msk.strftime('%Y-%m-%d %H:%M:%S')
 
-    return moderation_collection.insert_one(document).inserted_id
+    new_documents = []
+    for doc, is_duplicate, text_hash in zip(documents, duplicates, text_hashes):
+        if is_duplicate:
+            print(f"Документ уже существует в базе данных: {doc['title']}")
+            continue
+        new_documents.append({
+            "title": doc["title"],
+            "content": doc["content"],
+            "file_path": doc["file_path"],
+            "user": user,
+            "tags": [tag.lower() for tag in doc.get("tags") or []],
+            "content_hash": text_hash,
+            "file_hash": doc.get("file_hash"),
+            **MinHash.document_fields(doc["content"]),
+            "status": "pending",
+            "created_at": formatted_time,
+            "moderated_at": None,
+            "moderator": None,
+            "final_tags": None
+        })
+
+    inserted_ids = iter(mongoDB.insert_new_documents(moderation_collection, new_documents))
+
+    return [None if is_duplicate else next(inserted_ids) for is_duplicate in duplicates]
 
 
 def get_moderation_documents(status=None):
@@ -59,7 +111,7 @@ def get_moderation_document(doc_id):
         return None
 
 
-def approve_document(doc_id, moderator, final_tags=None):
+def approve_document(doc_id, moderator, final_tags=None, terms=None):
     from bson import ObjectId
     try:
         doc_id = ObjectId(doc_id)
@@ -78,7 +130,11 @@ def approve_document(doc_id, moderator, final_tags=None):
             content=doc["content"],
             file_path=doc["file_path"],
             user=doc["user"],
-            tags=final_tags if final_tags else doc["tags"]
+            tags=final_tags if final_tags else doc["tags"],
+            file_hash=doc.get("file_hash"),
+            terms=terms,
+            # Сигнатура посчитана при отправке на модерацию, текст с тех пор не менялся
+            minhash_fields={"minhash": doc["minhash"], "lsh_bands": doc["lsh_bands"]} if "lsh_bands" in doc else None
         )
 
         if result:
@@ -0,0 +1,125 @@
+import threading
+import time
+
+import psutil
+import spacy
+import pymorphy3
+
+import Settings
+from LemmaCache import LemmaCache
+
+
+def current_rss():
+    """
+    Возвращает объем резидентной памяти текущего процесса
+    :return: память в байтах
+    """
+    return psutil.Process().memory_info().rss
+
+
+class ModelRegistry:
+    """
+    Реестр NLP-моделей процесса: spaCy-пайплайн и морфологический анализатор загружаются один раз
+    и переиспользуются всеми запросами
+    """
+
+    def __init__(self, model_name=Settings.SPACY_MODEL):
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._nlp = None
+        self._morph = None
+        self._info = {"loaded": False, "loads": 0}
+
+
+    def _load(self):
+        """
+        Загружает модели и собирает статистику загрузки
+        :return: кортеж (nlp, morph, статистика)
+        """
+        rss_before = current_rss()
+        started = time.perf_counter()
+        nlp = spacy.load(self.model_name)
+        spacy_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        morph = pymorphy3.MorphAnalyzer()
+        morph_time = time.perf_counter() - started
+
+        info = {
+            "loaded": True,
+            "model_name": self.model_name,
+            "pipe_names": list(nlp.pipe_names),
+            "spacy_load_seconds": round(spacy_time, 3),
+            "morph_load_seconds": round(morph_time, 3),
+            "memory_delta_mb": round((current_rss() - rss_before) / 2 ** 20, 1),
+            "loaded_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        return nlp, morph, info
+
+
+    def _ensure_loaded(self):
+        if self._nlp is None:
+            with self._lock:
+                if self._nlp is None:
+                    nlp, morph, info = self._load()
+                    info["loads"] = self._info["loads"] + 1
+                    self._morph = morph
+                    self._nlp = nlp
+                    self._info = info
+
+
+    def get_nlp(self):
+        """
+        Возвращает общий spaCy-пайплайн, загружая его при первом обращении
+        """
+        self._ensure_loaded()
+        return self._nlp
+
+
+    def get_morph(self):
+        """
+        Возвращает общий морфологический анализатор pymorphy3
+        """
+        self._ensure_loaded()
+        return self._morph
+
+
+    def warm_up(self):
+        """
+        Загружает модели заранее и прогоняет через пайплайн короткий текст
+        :return: статистика загрузки
+        """
+        nlp = self.get_nlp()
+        nlp("Прогрев модели перед первым запросом.")
+        self.get_morph().parse("прогрев")
+        return self.info()
+
+
+    def reload(self):
+        """
+        Перезагружает модели. Новые модели подменяют старые только после полной загрузки,
+        поэтому запросы, уже работающие со старыми объектами, завершаются корректно
+        :return: статистика загрузки
+        """
+        nlp, morph, info = self._load()
+        with self._lock:
+            info["loads"] = self._info["loads"] + 1
+            self._morph = morph
+            self._nlp = nlp
+            self._info = info
+        lemma_cache.clear()
+        return self.info()
+
+
+    def info(self):
+        """
+        Возвращает статистику загрузки моделей и текущую память процесса
+        """
+        info = dict(self._info)
+        info["process_rss_mb"] = round(current_rss() / 2 ** 20, 1)
+        info["lemma_cache"] = lemma_cache.stats()
+        return info
+
+
+registry = ModelRegistry()
+lemma_cache = LemmaCache(Settings.LEMMA_CACHE_SIZE, Settings.LEMMA_CACHE_PATH or None)
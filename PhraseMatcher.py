@@ -0,0 +1,78 @@
+from collections import deque
+
+
+class PhraseMatcher:
+    """
+    Автомат Ахо-Корасик над последовательностями слов: находит все вхождения фраз словаря
+    любой длины за один проход по тексту
+    """
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._phrases = [[]]
+        self._output = [[]]
+        self._built = False
+        self.phrase_count = 0
+
+
+    def add(self, words, value):
+        """
+        Добавляет фразу в словарь автомата
+        :param words: последовательность слов фразы
+        :param value: значение, возвращаемое при совпадении
+        """
+        if not words:
+            return
+        node = 0
+        for word in words:
+            next_node = self._goto[node].get(word)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][word] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._phrases.append([])
+            node = next_node
+        self._phrases[node].append((len(words), value))
+        self.phrase_count += 1
+        self._built = False
+
+
+    def build(self):
+        """
+        Строит ссылки неудач автомата. Вызывается после добавления всех фраз
+        """
+        self._output = [list(phrases) for phrases in self._phrases]
+        queue = deque()
+        for next_node in self._goto[0].values():
+            self._fail[next_node] = 0
+            queue.append(next_node)
+
+        while queue:
+            node = queue.popleft()
+            for word, next_node in self._goto[node].items():
+                queue.append(next_node)
+                fail = self._fail[node]
+                while fail and word not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_node] = self._goto[fail].get(word, 0)
+                self._output[next_node] = self._output[next_node] + self._output[self._fail[next_node]]
+        self._built = True
+
+
+    def iter_matches(self, words):
+        """
+        Находит все вхождения фраз словаря в последовательности слов
+        :param words: последовательность слов текста
+        :return: генератор кортежей (позиция начала, длина фразы, значение)
+        """
+        if not self._built:
+            self.build()
+        node = 0
+        for i, word in enumerate(words):
+            while node and word not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(word, 0)
+            for length, value in self._output[node]:
+                yield i - length + 1, length, value
@@ -0,0 +1,92 @@
+import threading
+
+from CreateTags import TagGenerate
+from PhraseMatcher import PhraseMatcher
+
+
+class QueryAnalyzer:
+    """
+    Скомпилированный анализатор поисковых запросов: обратный индекс от нормализованной фразы-ассоциации
+    к основным тегам и автомат для поиска самых длинных фраз запроса за один проход
+    """
+
+    def __init__(self, tag_methods, tag_associations):
+        self.tag_methods = tag_methods
+        self.reverse_index = {}
+        self.phrase_forms = {}
+        self.matcher = PhraseMatcher()
+
+        for tag, associations in tag_associations.items():
+            for phrase in [tag] + list(associations):
+                lemmas = tuple(tag_methods.phrase_lemmas(phrase))
+                if not lemmas:
+                    continue
+                if lemmas not in self.reverse_index:
+                    self.reverse_index[lemmas] = set()
+                    self.phrase_forms[lemmas] = set()
+                    self.matcher.add(lemmas, lemmas)
+                self.reverse_index[lemmas].add(tag)
+                self.phrase_forms[lemmas].add(phrase.lower())
+        self.matcher.build()
+
+
+    def longest_matches(self, words):
+        """
+        Выбирает самые длинные непересекающиеся фразы словаря в запросе, начиная слева
+        :param words: массив нормализованных слов запроса
+        :return: массив нормализованных фраз
+        """
+        best = {}
+        for start, length, lemmas in self.matcher.iter_matches(words):
+            if length > best.get(start, (0, None))[0]:
+                best[start] = (length, lemmas)
+
+        phrases = []
+        position = 0
+        while position < len(words):
+            if position in best:
+                length, lemmas = best[position]
+                phrases.append(lemmas)
+                position += length
+            else:
+                position += 1
+        return phrases
+
+
+    def analyze(self, query):
+        """
+        Разбирает поисковый запрос
+        :param query: запрос
+        :return: кортеж (множество основных тегов, множество ключевых слов и фраз запроса)
+        """
+        words = self.tag_methods.phrase_lemmas(query)
+        matched_tags = set()
+        keywords = set(words)
+        for lemmas in self.longest_matches(words):
+            matched_tags.update(self.reverse_index[lemmas])
+            keywords.add(" ".join(lemmas))
+            keywords.update(self.phrase_forms[lemmas])
+        return matched_tags, keywords
+
+
+_lock = threading.Lock()
+_key = None
+_analyzer = None
+
+
+def get_analyzer(config_version, tag_associations):
+    """
+    Возвращает анализатор запросов. Анализатор перестраивается только при изменении версии
+    конфигурации тегов или перезагрузке моделей
+    :param config_version: версия конфигурации тегов
+    :param tag_associations: словарь основных тегов и их ассоциаций
+    :return: анализатор QueryAnalyzer
+    """
+    global _key, _analyzer
+    tag_methods = TagGenerate()
+    key = (id(tag_methods.nlp), config_version)
+    with _lock:
+        if _key != key:
+            _analyzer = QueryAnalyzer(tag_methods, tag_associations)
+            _key = key
+        return _analyzer
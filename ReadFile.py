@@ -1,11 +1,18 @@
 import PyPDF2
 from docx import Document
-import pandas as pd
+import openpyxl
 import re
 from fastapi import UploadFile
 from typing import BinaryIO
+import hashlib
 import io
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
 
+# Версия алгоритма извлечения текста, входит в ключ кэша результатов
+EXTRACTOR_VERSION = 2
 
 
 def clean_text(text: str) -> str:
@@ -13,28 +20,191 @@ def clean_text(text: str) -> str:
     cleaned_text = re.sub(r'\s+', ' ', cleaned_text).strip()
     return cleaned_text if cleaned_text else ""
 
+def pdf_page_count(file: BinaryIO) -> int:
+    return len(PyPDF2.PdfReader(file).pages)
+
+def iter_pdf_pages(file: BinaryIO, start: int = 0, stop: int = None):
+    """
+    Извлекает текст страниц PDF по одной, вызывая extract_text один раз на страницу
+    :param file: содержимое PDF-файла
+    :param start: номер первой страницы
+    :param stop: номер страницы, на которой нужно остановиться, None - до конца документа
+    :return: генератор очищенного текста непустых страниц
+    """
+    reader = PyPDF2.PdfReader(file)
+    total = len(reader.pages)
+    stop = total if stop is None else min(stop, total)
+    for number in range(start, stop):
+        text = clean_text(reader.pages[number].extract_text() or "")
+        if text:
+            yield text
+
+def read_pdf_text(file: BinaryIO) -> str:
+    return clean_text(" ".join(iter_pdf_pages(file)))
+
+def read_docx_text(file: BinaryIO) -> str:
+    doc = Document(file)
+    return clean_text(" ".join(
+        para.text for para in doc.paragraphs if para.text.strip()
+    ))
+
+def xlsx_sheet_names(file: BinaryIO) -> list:
+    workbook = openpyxl.load_workbook(file, read_only=True)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+def iter_xlsx_rows(file: BinaryIO, sheet_names=None):
+    """
+    Построчно читает листы книги Excel в режиме только для чтения, не загружая книгу в память целиком
+    :param file: содержимое xlsx-файла
+    :param sheet_names: названия листов, None - все листы
+    :return: генератор строк таблицы, собранных из непустых ячеек
+    """
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        for sheet_name in workbook.sheetnames:
+            if sheet_names is not None and sheet_name not in sheet_names:
+                continue
+            for row in workbook[sheet_name].iter_rows(values_only=True):
+                cells = []
+                for cell in row:
+                    if cell is None:
+                        continue
+                    value = str(cell).strip()
+                    if value:
+                        cells.append(value)
+                if cells:
+                    yield " ".join(cells)
+    finally:
+        workbook.close()
+
+def read_xlsx_text(file: BinaryIO, sheet_names=None) -> str:
+    return clean_text(" ".join(iter_xlsx_rows(file, sheet_names)))
+
+EXTRACTORS = {
+    '.pdf': read_pdf_text,
+    '.docx': read_docx_text,
+    '.xlsx': read_xlsx_text,
+}
+
+def extract_text(file_name: str, file: BinaryIO) -> str:
+    """
+    Извлекает текст из файла по его расширению
+    :param file_name: имя файла
+    :param file: содержимое файла
+    :return: очищенный текст или пустая строка для неподдерживаемых форматов
+    """
+    for extension, extractor in EXTRACTORS.items():
+        if file_name.endswith(extension):
+            return extractor(file)
+    return ""
+
+class MappedFile(io.RawIOBase):
+    """
+    Файловый объект только для чтения поверх mmap. Нужен потому, что сам mmap до Python 3.13
+    не имеет метода seekable, без которого zipfile не открывает docx и xlsx
+    """
+
+    def __init__(self, mapped):
+        super().__init__()
+        self._mapped = mapped
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = len(self._mapped) + offset
+        else:
+            raise ValueError(f"invalid whence ({whence})")
+        if position < 0:
+            raise ValueError(f"negative seek position {position}")
+        self._position = position
+        return position
+
+    def read(self, size=-1):
+        end = len(self._mapped) if size is None or size < 0 else self._position + size
+        data = self._mapped[self._position:end]
+        self._position += len(data)
+        return data
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+@contextmanager
+def open_mapped(path: str):
+    """
+    Открывает файл через отображение в память, не копируя его содержимое в процесс
+    :param path: путь к файлу
+    :return: файловый объект только для чтения поверх mmap
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield io.BytesIO(b"")
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with MappedFile(mapped) as mapped_file:
+                yield mapped_file
+
+def extract_file_text(file_name: str, path: str) -> str:
+    """
+    Извлекает текст из сохраненного на диске файла
+    :param file_name: имя файла, по расширению которого выбирается способ извлечения
+    :param path: путь к файлу
+    :return: очищенный текст или пустая строка для неподдерживаемых форматов
+    """
+    with open_mapped(path) as mapped:
+        return extract_text(file_name, mapped)
+
+def spool_to_disk(source: BinaryIO, directory: str, chunk_size: int):
+    """
+    Записывает поток во временный файл блоками фиксированного размера, одновременно считая SHA-256
+    :param source: исходный поток
+    :param directory: каталог для временного файла
+    :param chunk_size: размер блока в байтах
+    :return: путь к временному файлу, SHA-256 содержимого и размер в байтах
+    """
+    fd, path = tempfile.mkstemp(dir=directory, suffix=".part")
+    file_hash = hashlib.sha256()
+    size = 0
+    try:
+        source.seek(0)
+        with os.fdopen(fd, "wb") as target:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                file_hash.update(chunk)
+                target.write(chunk)
+                size += len(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, file_hash.hexdigest(), size
+
 async def extract_pdf_text(file: BinaryIO) -> str:
-    content = file.read()
-    with io.BytesIO(content) as pdf_file:
-        reader = PyPDF2.PdfReader(pdf_file)
-        return clean_text(" ".join(
-            page.extract_text() for page in reader.pages if page.extract_text()
-        ))
+    return read_pdf_text(file)
 
 async def extract_docx_text(file: BinaryIO) -> str:
-    content = file.read()
-    with io.BytesIO(content) as docx_file:
-        doc = Document(docx_file)
-        return clean_text(" ".join(
-            para.text for para in doc.paragraphs if para.text.strip()
-        ))
+    return read_docx_text(file)
 
 async def extract_xlsx_text(file: BinaryIO) -> str:
-    content =  file.read()
-    with io.BytesIO(content) as xlsx_file:
-        df = pd.read_excel(xlsx_file)
-        return clean_text(" ".join(
-            str(cell) for row in df.values for cell in row
-            if pd.notna(cell) and str(cell).strip()
-        ))
-
+    return read_xlsx_text(file)
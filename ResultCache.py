@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import Settings
+
+
+def fingerprint(items):
+    """
+    Возвращает короткий отпечаток последовательности строк, например словаря тегов
+    :param items: последовательность строк
+    :return: шестнадцатеричная строка
+    """
+    return hashlib.sha256("\n".join(items).encode("utf-8")).hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    Персистентный кэш результатов разбора файлов и генерации тегов.
+    Хранится в SQLite, вытесняет давно не использованные записи при превышении размера
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+        self.hits = 0
+        self.misses = 0
+
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "size INTEGER NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (kind, key))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self._conn.commit()
+        return self._conn
+
+
+    def get(self, kind, key):
+        """
+        Возвращает сохраненный результат
+        :param kind: тип результата (text - текст файла, tags - автоматические теги)
+        :param key: ключ записи
+        :return: результат или None, если запись не найдена
+        """
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM entries WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            conn.execute("UPDATE entries SET accessed = ? WHERE kind = ? AND key = ?", (time.time(), kind, key))
+            conn.commit()
+            return json.loads(row[0])
+
+
+    def set(self, kind, key, value):
+        """
+        Сохраняет результат и вытесняет старые записи при превышении размера кэша
+        :param kind: тип результата
+        :param key: ключ записи
+        :param value: результат, сериализуемый в JSON
+        """
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (kind, key, value, size, accessed) VALUES (?, ?, ?, ?, ?)",
+                (kind, key, data, size, time.time())
+            )
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                rows = conn.execute("SELECT kind, key, size FROM entries ORDER BY accessed").fetchall()
+                for row_kind, row_key, row_size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM entries WHERE kind = ? AND key = ?", (row_kind, row_key))
+                    total -= row_size
+            conn.commit()
+
+
+    def invalidate(self, kind=None):
+        """
+        Удаляет записи указанного типа или все записи
+        :param kind: тип результата, None - очистить весь кэш
+        """
+        with self._lock:
+            conn = self._connect()
+            if kind is None:
+                conn.execute("DELETE FROM entries")
+            else:
+                conn.execute("DELETE FROM entries WHERE kind = ?", (kind,))
+            conn.commit()
+
+
+    def stats(self):
+        with self._lock:
+            conn = self._connect()
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            requests = self.hits + self.misses
+            return {
+                "entries": count,
+                "size_mb": round(total / 2 ** 20, 2),
+                "max_size_mb": round(self.max_bytes / 2 ** 20, 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / requests, 3) if requests else 0.0
+            }
+
+
+result_cache = ResultCache(Settings.RESULT_CACHE_PATH, Settings.RESULT_CACHE_MAX_MB * 2 ** 20)
@@ -0,0 +1,202 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from pymongo import ReturnDocument
+
+import Database
+import Settings
+
+# Метка записей, зависящих от текста документов (полнотекстовый и смешанный режимы)
+CONTENT_DEPENDENCY = "*content*"
+# Метка инвалидации, очищающей кэш целиком
+ALL_DEPENDENCY = "*all*"
+SEQUENCE_ID = "sequence"
+
+
+def normalize_query(query):
+    """
+    Приводит запрос к виду, используемому в ключе кэша
+    :param query: поисковый запрос
+    :return: запрос в нижнем регистре с одиночными пробелами
+    """
+    return " ".join(query.lower().split())
+
+
+class SearchCache:
+    """
+    LRU-кэш оценок поисковых запросов с ограниченным временем жизни записей.
+    Каждая запись помнит теги, от которых зависит, и удаляется при изменении документов этих тегов.
+    Инвалидации записываются в журнал в MongoDB с порядковыми номерами, поэтому их видят кэши
+    других процессов: обработчиков uvicorn, Ingest.py и фоновых задач
+    """
+
+    def __init__(self, max_size, ttl, log_collection=None, sync_interval=Settings.SEARCH_CACHE_SYNC_INTERVAL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.log_collection = log_collection
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._by_tag = {}
+        self._sequence = None
+        self._own_sequences = set()
+        self._synced_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.remote_invalidations = 0
+
+
+    def ensure_indexes(self):
+        if self.log_collection is not None:
+            self.log_collection.create_index("created_at", expireAfterSeconds=Settings.SEARCH_CACHE_LOG_TTL)
+
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+
+
+    def _clear_local(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_tag.clear()
+
+
+    def _invalidate_local(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._by_tag.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+
+    def _publish(self, tags):
+        """
+        Записывает инвалидацию в общий журнал
+        :param tags: массив тегов
+        """
+        if self.log_collection is None:
+            return
+        sequence = self.log_collection.find_one_and_update(
+            {"_id": SEQUENCE_ID}, {"$inc": {"value": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+        )["value"]
+        self.log_collection.insert_one({"_id": sequence, "tags": list(tags), "created_at": datetime.utcnow()})
+        with self._lock:
+            self._own_sequences.add(sequence)
+
+
+    def sync(self):
+        """
+        Применяет инвалидации, записанные другими процессами. Журнал читается не чаще одного раза
+        за sync_interval секунд. Если часть записей журнала уже удалена или еще не записана, кэш очищается целиком
+        """
+        if self.log_collection is None or time.monotonic() - self._synced_at < self.sync_interval:
+            return
+        with self._sync_lock:
+            if time.monotonic() - self._synced_at < self.sync_interval:
+                return
+            counter = self.log_collection.find_one({"_id": SEQUENCE_ID})
+            sequence = counter["value"] if counter else 0
+            if self._sequence is None or sequence < self._sequence:
+                self._clear_local()
+                with self._lock:
+                    self._own_sequences.clear()
+            elif sequence > self._sequence:
+                entries = list(self.log_collection.find({"_id": {"$gt": self._sequence, "$lte": sequence}}))
+                with self._lock:
+                    # Свои инвалидации уже применены при записи
+                    own = {entry["_id"] for entry in entries} & self._own_sequences
+                    self._own_sequences -= own
+                tags = {tag for entry in entries if entry["_id"] not in own for tag in entry["tags"]}
+                if len(entries) < sequence - self._sequence or ALL_DEPENDENCY in tags:
+                    self._clear_local()
+                else:
+                    self._invalidate_local(tags)
+                self.remote_invalidations += sequence - self._sequence - len(own)
+            self._sequence = sequence
+            self._synced_at = time.monotonic()
+
+
+    def get(self, key):
+        """
+        Возвращает сохраненные оценки запроса
+        :param key: ключ (нормализованный запрос, режим, версия конфигурации тегов)
+        :return: оценки или None, если запись не найдена или устарела
+        """
+        self.sync()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+
+    def set(self, key, value, tags):
+        """
+        Сохраняет оценки запроса
+        :param key: ключ записи
+        :param value: оценки
+        :param tags: теги, при изменении документов которых запись устаревает
+        """
+        tags = frozenset(tags)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic(), value, tags)
+            for tag in tags:
+                self._by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+
+    def invalidate_tags(self, tags):
+        """
+        Удаляет записи, зависящие от указанных тегов, в этом и в остальных процессах
+        :param tags: массив тегов
+        """
+        tags = list(tags)
+        if not tags:
+            return
+        self._invalidate_local(tags)
+        self._publish(tags)
+
+
+    def clear(self):
+        self._clear_local()
+        self._publish([ALL_DEPENDENCY])
+
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "remote_invalidations": self.remote_invalidations,
+                "sequence": self._sequence,
+                "hit_rate": round(self.hits / requests, 3) if requests else 0.0
+            }
+
+
+search_cache = SearchCache(
+    Settings.SEARCH_CACHE_SIZE, Settings.SEARCH_CACHE_TTL, Database.get_database()['search_cache_invalidations']
+)
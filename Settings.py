@@ -0,0 +1,108 @@
+import os
+
+# Название spaCy-модели для извлечения тегов
+SPACY_MODEL = os.getenv("SPACY_MODEL", "ru_core_news_sm")
+
+# Максимальное количество слов в кэше нормальных форм
+LEMMA_CACHE_SIZE = int(os.getenv("LEMMA_CACHE_SIZE", "100000"))
+# Файл для сохранения кэша нормальных форм между перезапусками (пустая строка - не сохранять)
+LEMMA_CACHE_PATH = os.getenv("LEMMA_CACHE_PATH", "")
+
+# Размер пакета и количество процессов spaCy при пакетной генерации тегов
+TAGGING_BATCH_SIZE = int(os.getenv("TAGGING_BATCH_SIZE", "16"))
+TAGGING_N_PROCESS = int(os.getenv("TAGGING_N_PROCESS", "1"))
+
+# Пул процессов для разбора файлов и генерации тегов
+USE_PROCESS_POOL = os.getenv("USE_PROCESS_POOL", "1") == "1"
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(os.cpu_count() or 1)))
+PROCESS_START_METHOD = os.getenv("PROCESS_START_METHOD", "spawn")
+# Пул потоков для операций ввода-вывода
+IO_WORKERS = int(os.getenv("IO_WORKERS", "16"))
+# Максимальное количество ожидающих задач в каждом пуле и время выполнения задачи в секундах
+EXECUTOR_MAX_QUEUE = int(os.getenv("EXECUTOR_MAX_QUEUE", "64"))
+TASK_TIMEOUT = float(os.getenv("TASK_TIMEOUT", "300"))
+# Количество одновременно обрабатываемых файлов пакета и одновременных частей файлов (страниц PDF,
+# листов Excel) во всех запросах. Должны быть заметно меньше EXECUTOR_MAX_QUEUE, чтобы пакетная
+# загрузка не отклонялась ограничением очереди
+BATCH_FILE_CONCURRENCY = int(os.getenv("BATCH_FILE_CONCURRENCY", str(max(1, EXECUTOR_MAX_QUEUE // 8))))
+CPU_FANOUT_LIMIT = int(os.getenv("CPU_FANOUT_LIMIT", str(max(1, EXECUTOR_MAX_QUEUE // 4))))
+# Максимальная длина фрагмента текста (в символах) при генерации тегов
+TAGGING_CHUNK_CHARS = int(os.getenv("TAGGING_CHUNK_CHARS", "20000"))
+
+# Персистентный кэш текста файлов и автоматических тегов по SHA-256 содержимого
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", os.path.join("cache", "results.sqlite3"))
+RESULT_CACHE_MAX_MB = int(os.getenv("RESULT_CACHE_MAX_MB", "256"))
+# Среднее количество предложений во фрагменте текста (граница фрагмента зависит от содержимого)
+PARAGRAPH_SENTENCES = int(os.getenv("PARAGRAPH_SENTENCES", "8"))
+# Время хранения неиспользуемых результатов анализа фрагментов в днях
+PARAGRAPH_CACHE_TTL_DAYS = int(os.getenv("PARAGRAPH_CACHE_TTL_DAYS", "30"))
+
+# Параллельное извлечение текста PDF: минимальное количество страниц, страниц в одной задаче
+# и максимальное количество одновременно обрабатываемых задач
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+PDF_INFLIGHT_WINDOW = int(os.getenv("PDF_INFLIGHT_WINDOW", str(2 * CPU_WORKERS)))
+# Параллельная обработка листов книги Excel в пуле процессов
+XLSX_PARALLEL_SHEETS = os.getenv("XLSX_PARALLEL_SHEETS", "0") == "1"
+
+# Каталог загруженных файлов
+UPLOAD_DIRECTORY = os.getenv("UPLOAD_DIRECTORY", "uploads")
+# Размер блока при записи загружаемого файла на диск
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# Подключение к MongoDB и настройки пула соединений
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "database")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", str(max(IO_WORKERS, 16))))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+
+# Интервал проверки версии конфигурации тегов в базе данных, секунды
+CONFIG_CACHE_TTL = float(os.getenv("CONFIG_CACHE_TTL", "2"))
+
+# Количество документов, запрашиваемых одним запросом $in при поиске
+SEARCH_FETCH_BATCH = int(os.getenv("SEARCH_FETCH_BATCH", "1000"))
+
+# Параметры ранжирования BM25 и вес полнотекстовой релевантности в смешанном режиме поиска
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+SEARCH_HYBRID_WEIGHT = float(os.getenv("SEARCH_HYBRID_WEIGHT", "0.5"))
+# Максимальное количество документов, читаемых из индекса для одного термина запроса
+BM25_MAX_POSTINGS = int(os.getenv("BM25_MAX_POSTINGS", "5000"))
+
+# Размер страницы результатов поиска по умолчанию и максимальный
+SEARCH_DEFAULT_LIMIT = int(os.getenv("SEARCH_DEFAULT_LIMIT", "20"))
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "100"))
+
+# Кэш результатов поиска: количество запросов и время жизни записи в секундах
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1000"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "60"))
+# Как часто (в секундах) кэш поиска проверяет инвалидации из других процессов и сколько секунд они хранятся
+SEARCH_CACHE_SYNC_INTERVAL = float(os.getenv("SEARCH_CACHE_SYNC_INTERVAL", "1"))
+SEARCH_CACHE_LOG_TTL = int(os.getenv("SEARCH_CACHE_LOG_TTL", "3600"))
+
+# Поиск похожих документов: длина шингла в словах, размер MinHash-сигнатуры, количество полос LSH
+# и минимальная оценка сходства, при которой документ считается почти дубликатом
+SHINGLE_SIZE = int(os.getenv("SHINGLE_SIZE", "3"))
+MINHASH_NUM_PERM = int(os.getenv("MINHASH_NUM_PERM", "128"))
+MINHASH_BANDS = int(os.getenv("MINHASH_BANDS", "16"))
+MINHASH_SEED = int(os.getenv("MINHASH_SEED", "1"))
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+
+# Записывать изменения связей документов и тегов в транзакции (нужен replica set MongoDB)
+TAG_WRITES_TRANSACTIONAL = os.getenv("TAG_WRITES_TRANSACTIONAL", "0") == "1"
+
+# Количество записей коллекции tag_postings, читаемых за один запрос
+POSTINGS_PAGE_SIZE = int(os.getenv("POSTINGS_PAGE_SIZE", "1000"))
+
+# Фоновые задачи загрузки: количество обработчиков в процессе, число попыток, срок аренды задачи,
+# начальная задержка повтора и интервал опроса очереди в секундах, срок хранения завершенных задач в днях
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "5"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_RESULT_TTL_DAYS = int(os.getenv("JOB_RESULT_TTL_DAYS", "7"))
@@ -1,5 +1,79 @@
-from rapidfuzz import fuzz
+import threading
+
+import numpy as np
+from rapidfuzz import fuzz, process
 
 def is_similar(predefined: str, tag: str, threshold: int = 70) -> bool:
     score = fuzz.partial_ratio(predefined.lower(), tag.lower())
-    return score >= threshold
\ No newline at end of file
+    return score >= threshold
+
+
+class TagMatcher:
+    """
+    Сопоставляет теги документа с основными тегами по их ассоциациям.
+    Дает тот же результат, что проверка is_similar для каждой пары, но сравнивает все теги
+    со всеми ассоциациями одним вызовом rapidfuzz.process.cdist и запоминает результаты
+    """
+
+    def __init__(self, tag_associations, max_cached=100000):
+        self.choices = []
+        self.owners = []
+        for const_tag, sim_tags in tag_associations.items():
+            for sim_tag in sim_tags:
+                self.choices.append(sim_tag.lower())
+                self.owners.append(const_tag)
+        self.max_cached = max_cached
+        self._lock = threading.Lock()
+        self._cache = {}
+
+
+    def match(self, tags, threshold):
+        """
+        Находит основные теги, хотя бы одна ассоциация которых похожа на тег документа
+        :param tags: массив тегов документа
+        :param threshold: минимальная оценка fuzz.partial_ratio
+        :return: словарь, где ключ - тег документа, значение - массив основных тегов в порядке словаря
+        """
+        with self._lock:
+            result = {tag: self._cache[(tag, threshold)] for tag in tags if (tag, threshold) in self._cache}
+        missing = [tag for tag in dict.fromkeys(tags) if tag not in result]
+        if not missing:
+            return result
+
+        computed = {tag: [] for tag in missing}
+        if self.choices:
+            scores = process.cdist(
+                self.choices, [tag.lower() for tag in missing], scorer=fuzz.partial_ratio, score_cutoff=threshold
+            )
+            for j, tag in enumerate(missing):
+                for i in np.nonzero(scores[:, j] >= threshold)[0]:
+                    if self.owners[i] not in computed[tag]:
+                        computed[tag].append(self.owners[i])
+
+        with self._lock:
+            if len(self._cache) + len(computed) > self.max_cached:
+                self._cache.clear()
+            for tag, const_tags in computed.items():
+                self._cache[(tag, threshold)] = const_tags
+        result.update(computed)
+        return result
+
+
+_lock = threading.Lock()
+_key = None
+_matcher = None
+
+
+def get_matcher(config_version, tag_associations):
+    """
+    Возвращает сопоставитель тегов. Перестраивается только при изменении версии конфигурации тегов
+    :param config_version: версия конфигурации тегов
+    :param tag_associations: словарь основных тегов и их ассоциаций
+    :return: сопоставитель TagMatcher
+    """
+    global _key, _matcher
+    with _lock:
+        if _key != config_version:
+            _matcher = TagMatcher(tag_associations)
+            _key = config_version
+        return _matcher
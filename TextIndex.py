@@ -0,0 +1,171 @@
+import math
+import re
+from collections import Counter
+
+from pymongo import ASCENDING, DESCENDING
+
+import Database
+import NlpModels
+import Settings
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def extract_terms(text):
+    """
+    Разбивает текст на слова и приводит их к именительному падежу, пропуская стоп-слова
+    :param text: текст документа или запроса
+    :return: словарь, где ключ - термин, значение - количество вхождений
+    """
+    from CreateTags import TagGenerate
+    tag_methods = TagGenerate()
+    stop_words = tag_methods.nlp.Defaults.stop_words
+    counts = Counter()
+    for word in WORD_PATTERN.findall(text.lower()):
+        if word in stop_words or (len(word) < 2 and not word.isdigit()):
+            continue
+        counts[NlpModels.lemma_cache.get(word, tag_methods.word_to_nominative)] += 1
+    return counts
+
+
+class TextIndex:
+    """
+    Инвертированный индекс по содержимому документов для полнотекстового поиска с ранжированием BM25.
+    Для каждого термина хранятся документы, частота термина в документе, длина документа и вклад термина
+    в релевантность документа, по которому списки документов термина упорядочиваются при поиске
+    """
+
+    def __init__(self, db):
+        self.postings = db['text_postings']
+        self.documents = db['text_documents']
+        self.stats_collection = db['text_stats']
+
+
+    def ensure_indexes(self):
+        self.postings.create_index([("term", ASCENDING), ("doc_id", ASCENDING)], unique=True)
+        self.postings.create_index("doc_id")
+        self.postings.create_index([("term", ASCENDING), ("impact", DESCENDING)])
+
+
+    def get_stats(self):
+        stats = self.stats_collection.find_one({"_id": "global"}) or {}
+        return stats.get("doc_count", 0), stats.get("total_length", 0)
+
+
+    def index_documents(self, documents):
+        """
+        Добавляет документы в индекс, заменяя ранее проиндексированные версии
+        :param documents: массив троек (ID документа, текст документа, термины). Термины, посчитанные заранее
+        функцией extract_terms в пуле процессов, или None, тогда они вычисляются здесь
+        """
+        if not documents:
+            return
+        self.remove_documents([doc_id for doc_id, _, _ in documents])
+
+        counts_list = [extract_terms(content or "") if terms is None else terms for _, content, terms in documents]
+        lengths = [sum(counts.values()) for counts in counts_list]
+        total_length = sum(lengths)
+        doc_count, indexed_length = self.get_stats()
+        avg_length = (indexed_length + total_length) / (doc_count + len(documents)) or 1
+        k1, b = Settings.BM25_K1, Settings.BM25_B
+
+        postings = []
+        entries = []
+        for (doc_id, _, _), counts, length in zip(documents, counts_list, lengths):
+            entries.append({"_id": doc_id, "length": length})
+            norm = k1 * (1 - b + b * length / avg_length)
+            postings.extend({
+                "term": term, "doc_id": doc_id, "tf": tf, "dl": length, "impact": tf * (k1 + 1) / (tf + norm)
+            } for term, tf in counts.items())
+
+        if postings:
+            self.postings.insert_many(postings, ordered=False)
+        self.documents.insert_many(entries, ordered=False)
+        self.stats_collection.update_one(
+            {"_id": "global"},
+            {"$inc": {"doc_count": len(entries), "total_length": total_length}},
+            upsert=True
+        )
+
+
+    def index_document(self, doc_id, content, terms=None):
+        self.index_documents([(doc_id, content, terms)])
+
+
+    def remove_documents(self, doc_ids):
+        """
+        Удаляет документы из индекса
+        :param doc_ids: массив ID документов
+        """
+        entries = list(self.documents.find({"_id": {"$in": doc_ids}}, {"length": 1}))
+        if not entries:
+            return
+        removed_ids = [entry["_id"] for entry in entries]
+        self.postings.delete_many({"doc_id": {"$in": removed_ids}})
+        self.documents.delete_many({"_id": {"$in": removed_ids}})
+        self.stats_collection.update_one(
+            {"_id": "global"},
+            {"$inc": {"doc_count": -len(entries), "total_length": -sum(entry["length"] for entry in entries)}}
+        )
+
+
+    def remove_document(self, doc_id):
+        self.remove_documents([doc_id])
+
+
+    def score(self, query):
+        """
+        Ранжирует документы по запросу формулой BM25. Для каждого термина читается не больше
+        BM25_MAX_POSTINGS документов с наибольшим вкладом термина
+        :param query: поисковый запрос
+        :return: словарь, где ключ - ID документа, значение - релевантность
+        """
+        terms = list(extract_terms(query).keys())
+        doc_count, total_length = self.get_stats()
+        if not terms or doc_count <= 0:
+            return {}
+        avg_length = total_length / doc_count or 1
+
+        k1, b = Settings.BM25_K1, Settings.BM25_B
+        scores = {}
+        for term in terms:
+            term_docs = self.postings.count_documents({"term": term})
+            if not term_docs:
+                continue
+            idf = math.log(1 + (doc_count - term_docs + 0.5) / (term_docs + 0.5))
+            postings = self.postings.find(
+                {"term": term}, {"_id": 0, "doc_id": 1, "tf": 1, "dl": 1}
+            ).sort("impact", DESCENDING).limit(Settings.BM25_MAX_POSTINGS)
+            for posting in postings:
+                tf = posting["tf"]
+                norm = k1 * (1 - b + b * posting["dl"] / avg_length)
+                scores[posting["doc_id"]] = scores.get(posting["doc_id"], 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        return scores
+
+
+    def rebuild(self, batch_size=100):
+        """
+        Заново строит индекс по всем документам коллекции documents
+        :param batch_size: количество документов, индексируемых за один раз
+        :return: количество проиндексированных документов
+        """
+        self.postings.delete_many({})
+        self.documents.delete_many({})
+        self.stats_collection.delete_many({})
+        docs_collection = Database.get_database()["documents"]
+
+        indexed = 0
+        batch = []
+        for doc in docs_collection.find({}, {"content": 1}):
+            batch.append((doc["_id"], doc.get("content", ""), None))
+            if len(batch) >= batch_size:
+                self.index_documents(batch)
+                indexed += len(batch)
+                batch = []
+        if batch:
+            self.index_documents(batch)
+            indexed += len(batch)
+        return indexed
+
+
+text_index = TextIndex(Database.get_database())
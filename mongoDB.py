@@ -1,17 +1,217 @@
-from pymongo import MongoClient
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 from datetime import datetime
+import base64
+import copy
+import hashlib
+import heapq
+import json
+import threading
+import time
 import pytz
 from fastapi import HTTPException
 
+import Database
 import Dictionaries
+import MinHash
+import Settings
 import SimilarText
+from ResultCache import result_cache
+from SearchCache import search_cache, normalize_query, CONTENT_DEPENDENCY
+from TextIndex import text_index
 
-client = MongoClient("mongodb://localhost:27017/")
-db = client['database']
+db = Database.get_database()
 
 docs_collection = db["documents"]
 tags_collection = db['tags']
+postings_collection = db['tag_postings']
 config_collection = db['config']
+paragraphs_collection = db['paragraph_analyses']
+
+
+def content_hash(content):
+    """
+    Возвращает SHA-256 нормализованного текста документа: без учета регистра и пробельных символов
+    :param content: текст документа
+    :return: шестнадцатеричная строка
+    """
+    return hashlib.sha256(" ".join(content.lower().split()).encode("utf-8")).hexdigest()
+
+
+def ensure_document_indexes(collection):
+    """
+    Создает уникальные индексы для проверки дубликатов документов. Без них одновременные загрузки
+    могут добавить дубликаты, поэтому ошибка создания индекса останавливает запуск
+    :param collection: коллекция документов
+    """
+    failed = []
+    for field in ("title", "file_path", "content_hash", "file_hash"):
+        try:
+            collection.create_index(
+                field, unique=True, partialFilterExpression={field: {"$type": "string"}}
+            )
+        except OperationFailure as e:
+            print(f"Не удалось создать индекс {field} в {collection.name}: {e}")
+            failed.append(field)
+    collection.create_index("lsh_bands")
+    collection.create_index("job_id", partialFilterExpression={"job_id": {"$exists": True}})
+    if failed:
+        raise RuntimeError(
+            f"Не созданы уникальные индексы {', '.join(failed)} в {collection.name}. "
+            f"Запустите python Migrations.py и устраните найденные дубликаты"
+        )
+
+
+def duplicate_filter(title, file_path, text_hash, file_hash=None):
+    conditions = [{"title": title}, {"file_path": file_path}, {"content_hash": text_hash}]
+    if file_hash:
+        conditions.append({"file_hash": file_hash})
+    return {"$or": conditions}
+
+
+def find_duplicate(collection, title, file_path, content, file_hash=None, exclude_id=None):
+    """
+    Ищет документ, совпадающий с данным по названию, пути к файлу, тексту или содержимому файла
+    :param collection: коллекция документов
+    :param title: название документа
+    :param file_path: путь к файлу
+    :param content: текст документа
+    :param file_hash: SHA-256 содержимого файла
+    :param exclude_id: ID документа, который не считается дубликатом (например, обновляемого)
+    :return: найденный документ (только _id) или None
+    """
+    query = duplicate_filter(title, file_path, content_hash(content), file_hash)
+    if exclude_id is not None:
+        query["_id"] = {"$ne": exclude_id}
+    return collection.find_one(query, {"_id": 1})
+
+
+def insert_new_documents(collection, documents):
+    """
+    Пакетно добавляет документы. Документы, нарушившие уникальные индексы при одновременной загрузке,
+    считаются дубликатами
+    :param collection: коллекция документов
+    :param documents: массив документов
+    :return: массив ID добавленных документов, None для дубликатов
+    """
+    if not documents:
+        return []
+    failed = set()
+    try:
+        collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            if error.get("code") != 11000:
+                raise
+            failed.add(error["index"])
+    return [None if i in failed else doc["_id"] for i, doc in enumerate(documents)]
+
+
+def ensure_indexes():
+    """
+    Создает индексы служебных коллекций
+    """
+    ensure_document_indexes(docs_collection)
+    postings_collection.create_index([("tag", ASCENDING), ("doc_id", ASCENDING)], unique=True)
+    postings_collection.create_index("doc_id")
+    paragraphs_collection.create_index(
+        "used_at", expireAfterSeconds=Settings.PARAGRAPH_CACHE_TTL_DAYS * 24 * 3600
+    )
+    text_index.ensure_indexes()
+    search_cache.ensure_indexes()
+
+
+class ConfigCache:
+    """
+    Кэш конфигурации тегов в памяти процесса. Актуальность проверяется по счетчику version
+    в документе config не чаще одного раза за ttl секунд
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0.0
+        self.reloads = 0
+
+
+    def build_snapshot(self, config):
+        """
+        Вычисляет производные структуры конфигурации
+        :param config: документ конфигурации
+        :return: словарь с конфигурацией и производными структурами
+        """
+        dicts = [config.get(name, {}) for name in ('content_tags_dict', 'program_tags_dict', 'doc_type_dict')]
+
+        association_set = set()
+        for dic in dicts:
+            association_set.update(dic.keys())
+            for values in dic.values():
+                association_set.update(values)
+
+        phrases = list(config.get('other_tags', []))
+        for dic in dicts:
+            for tag, associations in dic.items():
+                phrases.append(tag)
+                phrases.extend(associations)
+        vocabulary = []
+        seen = set()
+        for phrase in phrases:
+            if phrase.lower() not in seen:
+                seen.add(phrase.lower())
+                vocabulary.append(phrase)
+
+        return {
+            "version": config.get('version', 0),
+            "config": config,
+            "association_set": association_set,
+            "const_tags": [tag for dic in dicts for tag in dic.keys()],
+            "tag_associations": dicts[0] | dicts[1] | dicts[2],
+            "vocabulary": vocabulary
+        }
+
+
+    def get(self):
+        """
+        Возвращает актуальную конфигурацию. Полный документ читается заново только при смене версии
+        :return: словарь с конфигурацией и производными структурами
+        """
+        now = time.monotonic()
+        snapshot = self._snapshot
+        if snapshot is not None and now - self._checked_at < self.ttl:
+            return snapshot
+
+        with self._lock:
+            if self._snapshot is not None and now - self._checked_at < self.ttl:
+                return self._snapshot
+            version_doc = config_collection.find_one({'_id': 'global_config'}, {'version': 1})
+            if not version_doc:
+                raise HTTPException(status_code=500, detail="config not found in DB")
+            if self._snapshot is None or version_doc.get('version', 0) != self._snapshot["version"]:
+                config = config_collection.find_one({'_id': 'global_config'})
+                if not config:
+                    raise HTTPException(status_code=500, detail="config not found in DB")
+                self._snapshot = self.build_snapshot(config)
+                self.reloads += 1
+            self._checked_at = now
+            return self._snapshot
+
+
+    def invalidate(self):
+        with self._lock:
+            self._checked_at = 0.0
+
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "version": snapshot["version"] if snapshot else None,
+            "ttl": self.ttl,
+            "reloads": self.reloads
+        }
+
+
+config_cache = ConfigCache(Settings.CONFIG_CACHE_TTL)
 
 
 class TagStructure:
@@ -19,20 +219,21 @@ class TagStructure:
     Класс функций по изменению структуры тегов
     """
 
+    _initialized = False
+
     def __init__(self):
-        self.init_cofig()
+        if not TagStructure._initialized:
+            self.init_cofig()
 
-        self.association_set = set()
-        for dic in (self.get_dict_by_name("content_tags_dict"), self.get_dict_by_name("program_tags_dict"),
-                    self.get_dict_by_name("doc_type_dict")):
-            self.association_set.update(dic.keys())
-            for values in dic.values():
-                self.association_set.update(values)
-        self.const_tags = list(self.get_dict_by_name("content_tags_dict").keys()) + list(
-            self.get_dict_by_name("program_tags_dict").keys()) + list(self.get_dict_by_name("doc_type_dict").keys())
-        if tags_collection.count_documents({}) == 0:
-            tags_collection.insert_many([{"name": tag.lower(), "documents": []} for tag in self.const_tags])
-        self.tag_associations = self.get_dict_by_name("content_tags_dict") | self.get_dict_by_name("program_tags_dict") | self.get_dict_by_name("doc_type_dict")
+        snapshot = config_cache.get()
+        self.association_set = snapshot["association_set"]
+        self.const_tags = snapshot["const_tags"]
+        self.tag_associations = snapshot["tag_associations"]
+
+        if not TagStructure._initialized:
+            if tags_collection.count_documents({}) == 0:
+                tags_collection.insert_many([{"name": tag.lower()} for tag in self.const_tags])
+            TagStructure._initialized = True
 
 
     def init_cofig(self):
@@ -40,6 +241,7 @@ class TagStructure:
         if not config:
             config = {
                 '_id': 'global_config',
+                'version': 0,
                 'global_tag_limit': Dictionaries.global_tag_limit,
                 'other_tags': Dictionaries.other_tags,
                 'content_tags_dict': Dictionaries.content_tags_dict,
@@ -51,10 +253,11 @@ class TagStructure:
 
 
     def get_config(self):
-        config = config_collection.find_one({'_id': 'global_config'})
-        if not config:
-            raise HTTPException(status_code=500, detail="config not found in DB")
-        return config
+        return config_cache.get()["config"]
+
+
+    def get_config_version(self):
+        return config_cache.get()["version"]
 
 
     def sync_tags_collection(self):
@@ -74,12 +277,13 @@ class TagStructure:
             for tag in tags_to_add:
                 tags_collection.update_one(
                     {"name": tag.lower()},
-                    {"$setOnInsert": {"documents": []}},
+                    {"$setOnInsert": {"name": tag.lower()}},
                     upsert = True
                 )
 
         if tags_to_remove:
             tags_collection.delete_many({"name": {"$in": list(tags_to_remove)}})
+            postings_collection.delete_many({"tag": {"$in": list(tags_to_remove)}})
         return {
             "tags_added": list(tags_to_add),
             "tags_removed": list(tags_to_remove)
@@ -87,7 +291,9 @@ class TagStructure:
 
 
     def update_config_field(self, field_name, value):
-        config_collection.update_one({'_id': 'global_config'}, {'$set': {field_name: value}})
+        config_collection.update_one({'_id': 'global_config'}, {'$set': {field_name: value}, '$inc': {'version': 1}})
+        config_cache.invalidate()
+        search_cache.clear()
 
 
     def get_dict_by_name(self, dict_name):
@@ -98,13 +304,13 @@ class TagStructure:
         """
         config = self.get_config()
         if dict_name == "other_tags":
-            return config.get('other_tags', [])
+            return copy.deepcopy(config.get('other_tags', []))
         elif dict_name == "content_tags_dict":
-            return config.get('content_tags_dict', {})
+            return copy.deepcopy(config.get('content_tags_dict', {}))
         elif dict_name == "program_tags_dict":
-            return config.get('program_tags_dict', {})
+            return copy.deepcopy(config.get('program_tags_dict', {}))
         elif dict_name == "doc_type_dict":
-            return config.get('doc_type_dict', {})
+            return copy.deepcopy(config.get('doc_type_dict', {}))
         else:
             raise HTTPException(status_code=400, detail="Unknown dictionary name")
 
@@ -126,6 +332,15 @@ class TagStructure:
             self.update_config_field('doc_type_dict', new_value)
         else:
             raise HTTPException(status_code=400, detail="Unknown dictionary name")
+        result_cache.invalidate("tags")
+
+
+    def get_tag_vocabulary(self):
+        """
+        Возвращает словарь фраз для автоматической генерации тегов: other_tags и все ассоциации
+        :return: массив фраз без повторов (без учета регистра)
+        """
+        return list(config_cache.get()["vocabulary"])
 
 
     def get_global_tag_limit(self):
@@ -162,17 +377,24 @@ class TagStructure:
         return total
 
 
-    def get_documents_by_tag(self, tag_name):
+    def get_documents_by_tag(self, tag_name, limit=Settings.POSTINGS_PAGE_SIZE, after_id=None):
         """
-        Получить список документов, связанных с тегом
+        Получить страницу документов, связанных с тегом, упорядоченных по ID
         :param tag_name: тег
-        :return: массив ID документов
+        :param limit: количество документов на странице
+        :param after_id: ID последнего документа предыдущей страницы
+        :return: массив словарей с полями _id и file_path или None, если тег не найден
         """
-        tag = tags_collection.find_one({"name": tag_name}, {"documents": 1})
-        if tag:
-            return tag.get("documents", [])
-        else:
+        query = {"tag": tag_name.lower()}
+        if after_id is not None:
+            query["doc_id"] = {"$gt": after_id}
+        postings = list(
+            postings_collection.find(query, {"_id": 0, "doc_id": 1, "file_path": 1})
+            .sort("doc_id", ASCENDING).limit(limit)
+        )
+        if not postings and after_id is None and not tags_collection.find_one({"name": tag_name.lower()}, {"_id": 1}):
             return None
+        return [{"_id": posting["doc_id"], "file_path": posting.get("file_path")} for posting in postings]
 
 
 class SearchFunction:
@@ -180,52 +402,234 @@ class SearchFunction:
     Класс функций для поиска по тегам
     """
 
-    def search_by_tag(self, query):
+    def tag_scores(self, query):
+        """
+        Оценивает документы по количеству совпавших с запросом тегов
+        :param query: запрос
+        :return: кортеж (словарь, где ключ - ID документа, значение - пара (количество совпадений, дата создания),
+                 множество найденных в запросе тегов)
+        """
+        from QueryAnalyzer import get_analyzer
+        snapshot = config_cache.get()
+        analyzer = get_analyzer(snapshot["version"], snapshot["tag_associations"])
+        matched_keys, keyword_set = analyzer.analyze(query)
+        matched_keys = {key.lower() for key in matched_keys}
+
+        scores = {}
+        for candidate_ids in self.iter_posting_pages(list(matched_keys)):
+            for doc in self.fetch_documents(candidate_ids, {"tags": 1, "created_at": 1}):
+                matches = keyword_set.intersection(doc.get('tags', []))
+                if matches:
+                    scores[doc['_id']] = (len(matches), datetime.strptime(doc['created_at'], '%Y-%m-%d %H:%M:%S'))
+        return scores, matched_keys
+
+
+    def iter_posting_pages(self, tags, page_size=Settings.POSTINGS_PAGE_SIZE):
+        """
+        Читает документы тегов страницами, упорядоченными по ID документа
+        :param tags: массив тегов
+        :param page_size: количество записей на странице
+        :return: генератор массивов ID документов без повторов
+        """
+        last_id = None
+        while tags:
+            query = {"tag": {"$in": tags}}
+            if last_id is not None:
+                query["doc_id"] = {"$gt": last_id}
+            postings = list(
+                postings_collection.find(query, {"_id": 0, "doc_id": 1})
+                .sort("doc_id", ASCENDING).limit(page_size)
+            )
+            if not postings:
+                return
+            page = []
+            for posting in postings:
+                if posting["doc_id"] != last_id:
+                    page.append(posting["doc_id"])
+                    last_id = posting["doc_id"]
+            yield page
+
+
+    def fetch_documents(self, doc_ids, projection):
+        """
+        Загружает документы пакетами запросов $in
+        :param doc_ids: массив ID документов
+        :param projection: загружаемые поля
+        :return: генератор документов
+        """
+        for start in range(0, len(doc_ids), Settings.SEARCH_FETCH_BATCH):
+            batch = doc_ids[start:start + Settings.SEARCH_FETCH_BATCH]
+            for doc in docs_collection.find({"_id": {"$in": batch}}, projection):
+                yield doc
+
+
+    def fetch_dates(self, doc_ids):
+        return {
+            doc['_id']: datetime.strptime(doc['created_at'], '%Y-%m-%d %H:%M:%S')
+            for doc in self.fetch_documents(list(doc_ids), {"created_at": 1})
+        }
+
+
+    def score_candidates(self, query, mode):
+        """
+        Оценивает релевантность документов запросу
+        :param query: запрос
+        :param mode: режим поиска: tags - по тегам, fulltext - по тексту (BM25), hybrid - смешанный
+        :return: кортеж (массив кортежей (релевантность, дата создания, ID документа),
+                 теги, от которых зависит результат)
+        """
+        if mode == "tags":
+            tag_scores, matched_keys = self.tag_scores(query)
+            return [(matches, date, str(doc_id)) for doc_id, (matches, date) in tag_scores.items()], matched_keys
+        elif mode == "fulltext":
+            text_scores = text_index.score(query)
+            dates = self.fetch_dates(text_scores.keys())
+            scored = [(score, dates[doc_id], str(doc_id)) for doc_id, score in text_scores.items() if doc_id in dates]
+            return scored, {CONTENT_DEPENDENCY}
+        elif mode == "hybrid":
+            tag_scores, matched_keys = self.tag_scores(query)
+            text_scores = text_index.score(query)
+            max_tag = max((matches for matches, _ in tag_scores.values()), default=0) or 1
+            max_text = max(text_scores.values(), default=0) or 1
+            weight = Settings.SEARCH_HYBRID_WEIGHT
+            dates = self.fetch_dates([doc_id for doc_id in text_scores if doc_id not in tag_scores])
+
+            scored = []
+            for doc_id in set(tag_scores) | set(text_scores):
+                if doc_id in tag_scores:
+                    tag_part, date = tag_scores[doc_id][0] / max_tag, tag_scores[doc_id][1]
+                elif doc_id in dates:
+                    tag_part, date = 0.0, dates[doc_id]
+                else:
+                    continue
+                score = weight * text_scores.get(doc_id, 0.0) / max_text + (1 - weight) * tag_part
+                scored.append((score, date, str(doc_id)))
+            return scored, matched_keys | {CONTENT_DEPENDENCY}
+        raise HTTPException(status_code=400, detail="Неизвестный режим поиска")
+
+
+    def encode_cursor(self, entry):
+        score, date, doc_id = entry
+        data = json.dumps([score, date.strftime('%Y-%m-%d %H:%M:%S'), doc_id])
+        return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+
+    def decode_cursor(self, cursor):
+        try:
+            score, date, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            return score, datetime.strptime(date, '%Y-%m-%d %H:%M:%S'), doc_id
+        except Exception:
+            raise HTTPException(status_code=400, detail="Некорректный курсор")
+
+
+    def rank_page(self, scored, limit, cursor=None):
+        """
+        Выбирает страницу лучших результатов кучей, не сортируя все кандидаты.
+        Результаты упорядочены по (релевантность, дата, ID) по убыванию
+        :param scored: массив кортежей (релевантность, дата создания, ID документа)
+        :param limit: размер страницы
+        :param cursor: курсор последнего результата предыдущей страницы
+        :return: кортеж (страница результатов, курсор следующей страницы или None)
+        """
+        if cursor:
+            after = self.decode_cursor(cursor)
+            scored = (entry for entry in scored if entry < after)
+        page = heapq.nlargest(limit + 1, scored)
+        next_cursor = self.encode_cursor(page[limit - 1]) if len(page) > limit else None
+        return page[:limit], next_cursor
+
+
+    def search(self, query, mode="tags", limit=Settings.SEARCH_DEFAULT_LIMIT, cursor=None):
         """
         Поиск документа по запросу
         :param query: запрос
-        :return: массив релевантных документов
+        :param mode: режим поиска: tags - по тегам, fulltext - по тексту (BM25), hybrid - смешанный
+        :param limit: количество документов на странице
+        :param cursor: курсор, полученный с предыдущей страницей
+        :return: кортеж (массив релевантных документов, курсор следующей страницы или None)
         """
-        from CreateTags import TagGenerate
-        tag_methods = TagGenerate()
-        tag_structure = TagStructure()
-        query_words = tag_methods.to_nominative_case(query).split()
-        keyword_set = set(query_words)
-
-        tag_associations = (tag_structure.get_dict_by_name("content_tags_dict") |
-                            tag_structure.get_dict_by_name("program_tags_dict") |
-                            tag_structure.get_dict_by_name("doc_type_dict"))
-
-        matched_keys = set()
-        for word in query_words:
-            for key, values in tag_associations.items():
-                if word in values:
-                    matched_keys.add(key)
-
-        relevance_score = []
-        seen_ids = set()
-
-        for key in matched_keys:
-            word_docs = tag_structure.get_documents_by_tag(key)
-            if word_docs:
-                for doc_id in word_docs:
-                    if str(doc_id['_id']) not in seen_ids:
-                        seen_ids.add(str(doc_id['_id']))
-                        doc = docs_collection.find_one({"_id":doc_id['_id']})
-                        doc_tags_set = set(doc['tags'])
-                        matches = keyword_set.intersection(doc_tags_set)
-                        date = datetime.strptime(doc['created_at'], '%Y-%m-%d %H:%M:%S')
-                        if matches:
-                            relevance_score.append((str(doc_id['_id']), len(matches), date))
-                            if len(relevance_score) > 20:
-                                relevance_score.sort(key=lambda x: (x[1], x[2]))
-                                relevance_score.pop(0)
-
-        sorted_documents = sorted(relevance_score, key=lambda x: (x[1], x[2]), reverse=True)
+        limit = max(1, min(limit, Settings.SEARCH_MAX_LIMIT))
+        key = (normalize_query(query), mode, config_cache.get()["version"])
+        scored = search_cache.get(key)
+        if scored is None:
+            scored, dependencies = self.score_candidates(query, mode)
+            search_cache.set(key, scored, dependencies)
+        page, next_cursor = self.rank_page(scored, limit, cursor)
         result = []
-        for case in sorted_documents:
-            result.append((case[0], case[2].strftime("%d.%m.%Y %H:%M")))
-        return result
+        for case in page:
+            result.append((case[2], case[1].strftime("%d.%m.%Y %H:%M")))
+        return result, next_cursor
+
+
+    def search_by_tag(self, query):
+        """
+        Поиск документа по тегам
+        :param query: запрос
+        :return: массив релевантных документов
+        """
+        return self.search(query, "tags")[0]
+
+
+class TagWrites:
+    """
+    Накапливает изменения связей документов и тегов и записывает их пакетами bulk_write:
+    число запросов к базе данных не зависит от количества тегов и документов
+    """
+
+    def __init__(self):
+        self.removed_docs = []
+        self.postings = {}
+        self.doc_tags = {}
+        self.touched_tags = set()
+
+
+    def add_posting(self, const_tag, doc_id, file_path):
+        self.postings[(const_tag.lower(), doc_id)] = file_path
+        tags = self.doc_tags.setdefault(doc_id, [])
+        if const_tag not in tags:
+            tags.append(const_tag)
+        self.touched_tags.add(const_tag.lower())
+
+
+    def remove_document(self, doc_id, tags):
+        """
+        Удаляет все связи документа с тегами
+        :param doc_id: ID документа
+        :param tags: теги документа, результаты поиска по которым устаревают
+        """
+        self.removed_docs.append(doc_id)
+        self.touched_tags.update(tag.lower() for tag in tags)
+
+
+    def _write(self, session=None):
+        if self.removed_docs:
+            postings_collection.delete_many({'doc_id': {'$in': self.removed_docs}}, session=session)
+        if self.postings:
+            postings_collection.bulk_write([
+                UpdateOne({'tag': tag, 'doc_id': doc_id}, {'$set': {'file_path': file_path}}, upsert=True)
+                for (tag, doc_id), file_path in self.postings.items()
+            ], ordered=False, session=session)
+        if self.doc_tags:
+            docs_collection.bulk_write([
+                UpdateOne({"_id": doc_id}, {"$addToSet": {"tags": {"$each": tags}}})
+                for doc_id, tags in self.doc_tags.items()
+            ], ordered=False, session=session)
+
+
+    def flush(self):
+        """
+        Записывает накопленные изменения. Удаления связей выполняются до добавления,
+        в режиме TAG_WRITES_TRANSACTIONAL все записи выполняются в одной транзакции
+        """
+        if Settings.TAG_WRITES_TRANSACTIONAL:
+            with Database.get_client().start_session() as session:
+                session.with_transaction(self._write)
+        else:
+            self._write()
+        if self.touched_tags:
+            search_cache.invalidate_tags(self.touched_tags)
+        self.removed_docs, self.postings, self.doc_tags = [], {}, {}
+        self.touched_tags = set()
 
 
 class TagCollectionChange:
@@ -233,33 +637,34 @@ class TagCollectionChange:
     Класс функций по обновлению коллекции tags при добавлении, удалении и редактировании документа в documents
     """
 
-    def upload_document(self, document_id, lower_tags, file_path):
+    def upload_document(self, document_id, lower_tags, file_path, writes=None):
         """
         Функция связывающая доумент и тег при добавлении документа в базу данных
         :param document_id: ID добавленного документа
         :param lower_tags: массив тегов документа
         :param file_path: путь хранения документа
+        :param writes: общий пакет изменений TagWrites, если не указан - изменения записываются сразу
         """
 
         tag_structure = TagStructure()
         tag_associations = tag_structure.tag_associations
         association_set = tag_structure.association_set
         use_flag = 0
+        own_writes = writes is None
+        if own_writes:
+            writes = TagWrites()
+
+        matcher = SimilarText.get_matcher(config_cache.get()["version"], tag_associations)
+        matches = matcher.match([tag for tag in lower_tags if tag in association_set], threshold=95)
 
         for tag in lower_tags:
             if tag in association_set:
                 use_flag = 1
-                for const_tag, sim_tags in tag_associations.items():
-                    if any(SimilarText.is_similar(st.lower(), tag, threshold=95) for st in sim_tags):
-                        tags_collection.update_one(
-                            {'name': const_tag},
-                            {'$addToSet': {'documents': {'_id': document_id, 'file_path': file_path}}}
-                        )
-                        docs_collection.update_one(
-                            {"_id": document_id},
-                            {"$addToSet": {"tags": const_tag}}
-                        )
+                for const_tag in matches[tag]:
+                    writes.add_posting(const_tag, document_id, file_path)
 
+        if own_writes:
+            writes.flush()
         if use_flag == 0:
             raise HTTPException(status_code=400, detail="Tags are not found")
 
@@ -272,16 +677,10 @@ class TagCollectionChange:
         :param tags: массив тегов документа
         """
 
-        tag_structure = TagStructure()
-        const_tags = tag_structure.const_tags
-
         if result.deleted_count > 0:
-            for tag in tags:
-                if tag in const_tags:
-                    tags_collection.update_one(
-                        {'name': tag},
-                        {'$pull': {'documents': {'_id': doc_id}}}
-                    )
+            writes = TagWrites()
+            writes.remove_document(doc_id, tags or [])
+            writes.flush()
         else:
             HTTPException(status_code=400, detail="Document is not found")
 
@@ -298,42 +697,28 @@ class TagCollectionChange:
         tag_structure = TagStructure()
         tag_associations = tag_structure.tag_associations
         association_set = tag_structure.association_set
-        const_tags = tag_structure.const_tags
         use_flag = 0
+        writes = TagWrites()
+        writes.remove_document(doc_id, old_tags or [])
 
-        for tag in old_tags:
-            if tag in const_tags:
-                tags_collection.update_one(
-                    {'name': tag},
-                    {'$pull': {'documnets': {'_id': doc_id}}}
-                )
+        matcher = SimilarText.get_matcher(config_cache.get()["version"], tag_associations)
+        matches = matcher.match([tag for tag in new_tags if tag in association_set], threshold=80)
 
         for tag in new_tags:
             if tag in association_set:
                 use_flag = 1
-                for const_tag, sim_tags in tag_associations.items():
-                    if any(SimilarText.is_similar(st.lower(), tag, threshold=80) for st in sim_tags):
-                        tags_collection.update_one(
-                            {'name': const_tag},
-                            {'$addToSet': {'documents': {'_id': doc_id, 'file_path': file_path}}}
-                        )
-                        docs_collection.update_one(
-                            {"_id": doc_id},
-                            {"$addToSet": {"tags": const_tag}}
-                        )
+                for const_tag in matches[tag]:
+                    writes.add_posting(const_tag, doc_id, file_path)
 
+        writes.flush()
         if use_flag == 0:
             raise HTTPException(status_code=400, detail="Tags are not found")
 
 
-def upload_document_to_db(title, content,file_path, user, tags=None):
-    duplicate = docs_collection.find_one({
-        "$or": [
-            {"title": title},
-            {"file_path": file_path},
-            {"content": content}
-        ]
-    })
+def upload_document_to_db(title, content,file_path, user, tags=None, file_hash=None, terms=None, job_id=None,
+                          minhash_fields=None):
+    text_hash = content_hash(content)
+    duplicate = docs_collection.find_one(duplicate_filter(title, file_path, text_hash, file_hash), {"_id": 1})
 
     if duplicate:
         print(f"Документ уже существует в базе данных: {title}")
@@ -351,9 +736,20 @@ def upload_document_to_db(title, content,file_path, user, tags=None):
         "file_path": file_path,  # Путь к файлу на сервере
         "user": user,             # students, teacher
         "tags": lower_tags if lower_tags else [],
-        "created_at": formatted_time
+        "content_hash": text_hash,
+        "file_hash": file_hash,
+        "created_at": formatted_time,
+        **(minhash_fields or MinHash.document_fields(content))
     }
-    document_id = docs_collection.insert_one(document).inserted_id
+    if job_id is not None:
+        document["job_id"] = job_id
+    try:
+        document_id = docs_collection.insert_one(document).inserted_id
+    except DuplicateKeyError:
+        print(f"Документ уже существует в базе данных: {title}")
+        return None
+    text_index.index_document(document_id, content, terms)
+    search_cache.invalidate_tags([CONTENT_DEPENDENCY])
 
     tags_coll_change = TagCollectionChange()
     tags_coll_change.upload_document(document_id, lower_tags, file_path)
@@ -361,6 +757,148 @@ def upload_document_to_db(title, content,file_path, user, tags=None):
     return document_id
 
 
+def find_batch_duplicates(collection, documents):
+    """
+    Определяет дубликаты для пакета документов одним запросом к коллекции по индексированным полям
+    :param collection: коллекция, в которой ищутся дубликаты
+    :param documents: массив словарей с полями title, content, file_path и, необязательно, file_hash
+    :return: массив флагов (True - документ является дубликатом) и массив хэшей текста документов
+    """
+    if not documents:
+        return [], []
+    text_hashes = [content_hash(doc["content"]) for doc in documents]
+    file_hashes = [doc["file_hash"] for doc in documents if doc.get("file_hash")]
+    existing = collection.find({
+        "$or": [
+            {"title": {"$in": [doc["title"] for doc in documents]}},
+            {"file_path": {"$in": [doc["file_path"] for doc in documents]}},
+            {"content_hash": {"$in": text_hashes}},
+            {"file_hash": {"$in": file_hashes}}
+        ]
+    }, {"title": 1, "file_path": 1, "content_hash": 1, "file_hash": 1})
+
+    seen = {"title": set(), "file_path": set(), "content_hash": set(), "file_hash": set()}
+    for doc in existing:
+        for field, values in seen.items():
+            if doc.get(field):
+                values.add(doc[field])
+
+    flags = []
+    for doc, text_hash in zip(documents, text_hashes):
+        keys = {"title": doc["title"], "file_path": doc["file_path"],
+                "content_hash": text_hash, "file_hash": doc.get("file_hash")}
+        is_duplicate = any(keys[field] and keys[field] in values for field, values in seen.items())
+        flags.append(is_duplicate)
+        if not is_duplicate:
+            for field, values in seen.items():
+                if keys[field]:
+                    values.add(keys[field])
+    return flags, text_hashes
+
+
+def upload_documents_to_db(documents, user):
+    """
+    Пакетно добавляет документы в базу данных
+    :param documents: массив словарей с полями title, content, file_path, tags и, необязательно, file_hash
+    и terms - термины полнотекстового индекса, посчитанные заранее
+    :param user: пользователь, загрузивший документы
+    :return: массив пар (ID документа, описание ошибки) в порядке входных документов
+    """
+    duplicates, text_hashes = find_batch_duplicates(docs_collection, documents)
+
+    moscow_tz = pytz.timezone('Europe/Moscow')
+    current_time_msk = datetime.now(moscow_tz)
+    formatted_time = current_time_msk.strftime('%Y-%m-%d %H:%M:%S')
+
+    new_documents = []
+    new_terms = []
+    for doc, is_duplicate, text_hash in zip(documents, duplicates, text_hashes):
+        if is_duplicate:
+            print(f"Документ уже существует в базе данных: {doc['title']}")
+            continue
+        new_terms.append(doc.get("terms"))
+        lower_tags = [tag.lower() for tag in doc.get("tags") or []]
+        new_documents.append({
+            "title": doc["title"],
+            "content": doc["content"],
+            "file_path": doc["file_path"],
+            "user": user,
+            "tags": lower_tags,
+            "content_hash": text_hash,
+            "file_hash": doc.get("file_hash"),
+            "created_at": formatted_time,
+            **MinHash.document_fields(doc["content"])
+        })
+
+    ids = insert_new_documents(docs_collection, new_documents)
+    indexed = [
+        (doc_id, doc["content"], terms)
+        for doc_id, doc, terms in zip(ids, new_documents, new_terms) if doc_id is not None
+    ]
+    if indexed:
+        text_index.index_documents(indexed)
+        search_cache.invalidate_tags([CONTENT_DEPENDENCY])
+
+    tags_coll_change = TagCollectionChange()
+    writes = TagWrites()
+    results = []
+    new_docs_iter = iter(zip(ids, new_documents))
+    for is_duplicate in duplicates:
+        if is_duplicate:
+            results.append((None, "Документ уже существует в базе данных"))
+            continue
+        document_id, document = next(new_docs_iter)
+        if document_id is None:
+            print(f"Документ уже существует в базе данных: {document['title']}")
+            results.append((None, "Документ уже существует в базе данных"))
+            continue
+        try:
+            tags_coll_change.upload_document(document_id, document["tags"], document["file_path"], writes)
+            results.append((document_id, None))
+        except HTTPException as e:
+            results.append((document_id, e.detail))
+    writes.flush()
+
+    return results
+
+
+def get_paragraph_analyses(keys):
+    """
+    Возвращает сохраненные результаты анализа фрагментов текста и продлевает срок их хранения
+    :param keys: ключи фрагментов (хэш фрагмента, версия модели и словаря тегов)
+    :return: словарь, где ключ - ключ фрагмента, значение - результат анализа
+    """
+    if not keys:
+        return {}
+    analyses = {
+        doc["_id"]: {"tokens": doc["tokens"], "candidates": doc["candidates"]}
+        for doc in paragraphs_collection.find({"_id": {"$in": keys}})
+    }
+    if analyses:
+        paragraphs_collection.update_many(
+            {"_id": {"$in": list(analyses.keys())}}, {"$set": {"used_at": datetime.utcnow()}}
+        )
+    return analyses
+
+
+def save_paragraph_analyses(analyses):
+    """
+    Сохраняет результаты анализа фрагментов текста
+    :param analyses: словарь, где ключ - ключ фрагмента, значение - результат анализа
+    """
+    if not analyses:
+        return
+    now = datetime.utcnow()
+    paragraphs_collection.bulk_write([
+        UpdateOne(
+            {"_id": key},
+            {"$set": {"tokens": analysis["tokens"], "candidates": analysis["candidates"], "used_at": now}},
+            upsert=True
+        )
+        for key, analysis in analyses.items()
+    ], ordered=False)
+
+
 def get_document_db(doc_id):
     from bson import ObjectId
     try:
@@ -375,6 +913,44 @@ def get_document_db(doc_id):
         print(f"Ошибка: {str(e)}")
         return None
 
+def find_similar_documents(doc_id, threshold=Settings.NEAR_DUPLICATE_THRESHOLD, limit=10):
+    """
+    Находит документы, похожие на документ из базы данных
+    :param doc_id: ID документа
+    :param threshold: минимальная оценка сходства
+    :param limit: максимальное количество документов
+    :return: массив похожих документов или None, если документ не найден
+    """
+    from bson import ObjectId
+    try:
+        doc_id = ObjectId(doc_id)
+    except Exception:
+        return None
+    document = docs_collection.find_one({"_id": doc_id}, {"minhash": 1, "lsh_bands": 1, "content": 1})
+    if not document:
+        return None
+    if "lsh_bands" not in document:
+        document.update(MinHash.document_fields(document.get("content") or ""))
+    return MinHash.find_similar(docs_collection, document, threshold, exclude_id=doc_id, limit=limit)
+
+
+def find_near_duplicates(content, collections=None, minhash_fields=None):
+    """
+    Находит почти дубликаты текста перед загрузкой документа
+    :param content: текст документа
+    :param collections: коллекции, в которых ищутся документы, по умолчанию - основная коллекция
+    :param minhash_fields: поля MinHash.document_fields текста, если они уже посчитаны
+    :return: массив похожих документов с названием коллекции
+    """
+    fields = minhash_fields or MinHash.document_fields(content)
+    near_duplicates = []
+    for collection in collections or [docs_collection]:
+        for doc in MinHash.find_similar(collection, fields):
+            doc["collection"] = collection.name
+            near_duplicates.append(doc)
+    return near_duplicates
+
+
 def delete_document_db(doc_id):
     from bson import ObjectId
     try:
@@ -384,6 +960,9 @@ def delete_document_db(doc_id):
         if document:
             tags = document.get("tags")
         result = docs_collection.delete_one({"_id": doc_id})
+        if result.deleted_count:
+            text_index.remove_document(doc_id)
+            search_cache.invalidate_tags([CONTENT_DEPENDENCY])
 
         tags_coll_change = TagCollectionChange()
         tags_coll_change.delete_document(result, doc_id, tags)
@@ -393,7 +972,8 @@ def delete_document_db(doc_id):
         print(f"Ошибка: {str(e)}")
         return 0
 
-def update_document_db(doc_id,new_content,new_file_path, new_tags=None, new_title=None):
+def update_document_db(doc_id,new_content,new_file_path, new_tags=None, new_title=None, new_file_hash=None,
+                       new_terms=None):
     from bson import ObjectId
     try:
         doc_id = ObjectId(doc_id)
@@ -404,7 +984,10 @@ def update_document_db(doc_id,new_content,new_file_path, new_tags=None, new_titl
             "file_path": new_file_path,
             "content": new_content,
             "tags": new_tags,
-            "updated_at": formatted_time
+            "content_hash": content_hash(new_content),
+            "file_hash": new_file_hash,
+            "updated_at": formatted_time,
+            **MinHash.document_fields(new_content)
         }
         if new_title:
             update_data["title"] = new_title
@@ -415,6 +998,9 @@ def update_document_db(doc_id,new_content,new_file_path, new_tags=None, new_titl
         old_tags = document.get("tags")
 
         result = docs_collection.update_one({"_id": doc_id}, {"$set": update_data})
+        if result.matched_count:
+            text_index.index_document(doc_id, new_content, new_terms)
+            search_cache.invalidate_tags([CONTENT_DEPENDENCY])
 
         tags_coll_change = TagCollectionChange()
         if new_tags:
@@ -425,6 +1011,9 @@ def update_document_db(doc_id,new_content,new_file_path, new_tags=None, new_titl
         else:
             print("Документ не найден.")
         return result.modified_count
+    except DuplicateKeyError:
+        print("Документ с таким содержимым уже существует.")
+        raise HTTPException(status_code=409, detail="Документ с таким файлом или содержимым уже существует")
     except Exception as e:
         print(f"Ошибка: {str(e)}")
         return 0
\ No newline at end of file